@@ -0,0 +1,138 @@
+'''
+Playback of animated images. The first frame is drawn in full; after that only the cells that
+changed since the previous frame are redrawn, reached with cursor positioning escapes. Frames are
+prepared on a separate thread ahead of display, so slow frames do not delay the ones before them.
+'''
+import sys
+import time
+import itertools
+import threading
+import Queue
+
+CLEAR = '\033[2J\033[H'
+HOME = '\033[H'
+HIDE_CURSOR = '\033[?25l'
+SHOW_CURSOR = '\033[?25h'
+MOVE = '\033[{0};{1}H'
+RESET = '\033[0m'
+
+# GIF frames shorter than this are shown for DEFAULT_DURATION instead, like browsers do
+MIN_DURATION = 0.02
+DEFAULT_DURATION = 0.1
+# Unchanged cells between two changed spans are redrawn rather than skipped when there are at most this many
+MERGE_GAP = 3
+
+
+def iter_frames(im):
+    '''
+    Yields (RGB frame, duration in seconds) for every frame of an opened image
+    '''
+    index = 0
+    while True:
+        try:
+            im.seek(index)
+        except EOFError:
+            return
+        duration = im.info.get('duration', 0) / 1000.
+        if duration < MIN_DURATION:
+            duration = DEFAULT_DURATION
+        yield im.convert('RGB'), duration
+        index += 1
+
+
+def prefetch(iterable, ahead):
+    '''
+    Consumes iterable on a background thread, keeping up to ahead items ready, and yields them in
+    order. An exception raised by iterable is raised again here.
+    '''
+    queue = Queue.Queue(maxsize=ahead)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                queue.put((item, None))
+        except Exception:
+            queue.put((None, sys.exc_info()))
+            return
+        queue.put((done, None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    while True:
+        item, error = queue.get()
+        if error is not None:
+            raise error[0], error[1], error[2]
+        if item is done:
+            return
+        yield item
+
+
+def get_spans(changed, gap=MERGE_GAP):
+    '''
+    Groups the sorted changed column indices into (start, end) spans, merging spans separated by
+    at most gap unchanged cells
+    '''
+    spans = []
+    for x in changed:
+        if spans and x - spans[-1][1] <= gap:
+            spans[-1][1] = x + 1
+        else:
+            spans.append([x, x + 1])
+    return spans
+
+
+def encode_diff(previous, current, line_encoder):
+    '''
+    Encodes the cells of current that differ from previous. Both are lists of (top, bottom) rows
+    of palette indices, as produced for every output line; bottom is None outside hires mode.
+    Rows where redrawing the changed spans would take more bytes than the whole row are redrawn.
+    '''
+    parts = []
+    for y, ((top, bottom), (prev_top, prev_bottom)) in enumerate(zip(current, previous)):
+        changed = [x for x in range(len(top))
+                   if top[x] != prev_top[x] or (bottom is not None and bottom[x] != prev_bottom[x])]
+        if not changed:
+            continue
+        spans = []
+        for start, end in get_spans(changed):
+            spans.append(MOVE.format(y + 1, start + 1))
+            spans.append(line_encoder.encode_line(top[start:end], bottom[start:end] if bottom is not None else None))
+        spans = u''.join(spans)
+        row = MOVE.format(y + 1, 1) + line_encoder.encode_line(top, bottom)
+        parts.append(spans if len(spans) <= len(row) else row)
+    return u''.join(parts)
+
+
+def play(frames, line_encoder, out, loop=False):
+    '''
+    Plays frames, an iterable of (rows, duration in seconds), on the terminal out. With loop the
+    frames are kept after the first pass and replayed from memory until interrupted.
+    '''
+    if loop:
+        frames = itertools.cycle(frames)
+    previous = None
+    out.write(CLEAR + HIDE_CURSOR)
+    try:
+        deadline = time.time()
+        for rows, duration in frames:
+            if previous is None or len(previous) != len(rows):
+                output = HOME + u'\n'.join(line_encoder.encode_line(top, bottom) for (top, bottom) in rows)
+            else:
+                output = encode_diff(previous, rows, line_encoder)
+            out.write(output.encode('utf8'))
+            out.flush()
+            previous = rows
+            deadline += duration
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -duration:
+                # Too far behind to catch up, so keep time from here on
+                deadline = time.time()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        out.write(RESET + MOVE.format(len(previous or ()) + 1, 1) + SHOW_CURSOR)
+        out.flush()
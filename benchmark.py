@@ -0,0 +1,189 @@
+#!/usr/bin/python
+'''
+Benchmarks the render pipeline stage by stage on a fixed corpus of generated images.
+
+Every image in the corpus is rendered in every palette mode and the wall time of each stage is
+reported: decode, resize, color matching, line encoding and output. Results can be saved as a
+baseline and later runs compared against it to catch regressions.
+
+    benchmark.py --save baseline.json
+    benchmark.py --compare baseline.json
+'''
+import os
+import sys
+import json
+import time
+import random
+from cStringIO import StringIO
+from optparse import OptionParser
+import Image, ImageDraw
+import termimage
+
+# (name, size, format) of every image in the corpus
+CORPUS = [
+    ('small', (320, 240), 'PNG'),
+    ('medium', (1280, 960), 'JPEG'),
+    ('large', (4000, 3000), 'JPEG'),
+]
+
+MODES = [
+    ('default', []),
+    ('hires', ['--hires']),
+    ('xterm', ['--xterm']),
+    ('xterm-hires', ['--xterm', '--hires']),
+    ('bw', ['--xterm', '--bw']),
+    ('irc', ['--irc']),
+    ('truecolor', ['--truecolor']),
+]
+
+STAGES = ['decode', 'resize', 'match', 'encode', 'output']
+
+
+def make_image(size, seed=0):
+    '''
+    Generates a deterministic test image with smooth gradients, hard edges and fine detail
+    '''
+    rand = random.Random(seed)
+    im = Image.new('RGB', (16, 12))
+    im.putdata([(rand.randint(0, 255), rand.randint(0, 255), rand.randint(0, 255)) for i in range(16 * 12)])
+    im = im.resize(size, Image.BICUBIC)
+    draw = ImageDraw.Draw(im)
+    width, height = size
+    for i in range(40):
+        x, y = rand.randint(0, width), rand.randint(0, height)
+        radius = rand.randint(width // 50, width // 8)
+        color = (rand.randint(0, 255), rand.randint(0, 255), rand.randint(0, 255))
+        if i % 2:
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+        else:
+            draw.rectangle((x - radius, y - radius // 2, x + radius, y + radius // 2), fill=color)
+    for i in range(200):
+        draw.line((rand.randint(0, width), rand.randint(0, height), rand.randint(0, width), rand.randint(0, height)),
+                  fill=(rand.randint(0, 255), rand.randint(0, 255), rand.randint(0, 255)))
+    return im
+
+
+def make_corpus():
+    '''
+    Returns [(name, encoded image bytes, pixel count)] for the corpus
+    '''
+    corpus = []
+    for seed, (name, size, format) in enumerate(CORPUS):
+        fs = StringIO()
+        make_image(size, seed).save(fs, format)
+        corpus.append((name, fs.getvalue(), size[0] * size[1]))
+    return corpus
+
+
+def run_once(renderer, data, sink):
+    '''
+    Renders the image bytes with a termimage renderer and returns ({stage: seconds}, output bytes)
+    '''
+    timings = {}
+    start = time.time()
+    im = Image.open(StringIO(data))
+    size = renderer.get_output_size(im.size)
+    im = renderer.decode_image(im, size)
+    timings['decode'] = time.time() - start
+
+    start = time.time()
+    im = renderer.resize_image(im, size)
+    timings['resize'] = time.time() - start
+
+    start = time.time()
+    rows = list(renderer.iter_index_rows(im))
+    timings['match'] = time.time() - start
+
+    start = time.time()
+    line_encoder = renderer.get_encoder()
+    lines = [line_encoder.encode_line(top, bottom) for (top, bottom) in rows]
+    timings['encode'] = time.time() - start
+
+    start = time.time()
+    output = 0
+    for line in lines:
+        line = line.encode('utf8') + '\n'
+        sink.write(line)
+        output += len(line)
+    sink.flush()
+    timings['output'] = time.time() - start
+    return timings, output
+
+
+def run(corpus, modes, repeat, sink):
+    '''
+    Runs every image in every mode and returns {'image mode': result}. Each stage time is the
+    best of repeat runs.
+    '''
+    results = {}
+    for mode, argv in modes:
+        renderer = termimage.Renderer(termimage.parser.parse_args(argv)[0], cache_size=0)
+        for name, data, pixels in corpus:
+            best = dict((stage, None) for stage in STAGES)
+            for i in range(repeat):
+                timings, output = run_once(renderer, data, sink)
+                for stage in STAGES:
+                    if best[stage] is None or timings[stage] < best[stage]:
+                        best[stage] = timings[stage]
+            total = sum(best.values())
+            results['%s %s' % (name, mode)] = dict(best, total=total, pixels=pixels,
+                                                   pixels_per_second=pixels / total, output_bytes=output)
+    return results
+
+
+def print_results(results, baseline=None, threshold=0.1):
+    '''
+    Prints a table of the results. With a baseline, totals that are more than threshold slower
+    are marked and counted. Returns the number of regressions.
+    '''
+    regressions = 0
+    header = '%-20s' % 'case' + ''.join('%9s' % stage for stage in STAGES + ['total']) + '%12s%10s' % ('Mpx/s', 'bytes')
+    if baseline:
+        header += '%10s' % 'change'
+    print header
+    for key in sorted(results):
+        result = results[key]
+        row = '%-20s' % key + ''.join('%7.1fms' % (result[stage] * 1000) for stage in STAGES + ['total'])
+        row += '%12.2f%10d' % (result['pixels_per_second'] / 1e6, result['output_bytes'])
+        if baseline and key in baseline:
+            change = result['total'] / baseline[key]['total'] - 1
+            row += '%+9.1f%%' % (change * 100)
+            if change > threshold:
+                row += ' SLOWER'
+                regressions += 1
+        print row
+    return regressions
+
+
+def main():
+    parser = OptionParser(description='Benchmarks the render pipeline stage by stage.')
+    parser.add_option('-n', '--repeat', action='store', dest='repeat', type=int, default=3,
+                      help='Runs per case; the best time of each stage is kept. Default is 3.')
+    parser.add_option('--save', action='store', dest='save', metavar='FILE',
+                      help='Store the results as a baseline in FILE.')
+    parser.add_option('--compare', action='store', dest='compare', metavar='FILE',
+                      help='Compare against the baseline in FILE and exit with status 1 on regressions.')
+    parser.add_option('--threshold', action='store', dest='threshold', type=float, default=10.0, metavar='PERCENT',
+                      help='Slowdown of the total time counted as a regression. Default is 10.')
+    parser.add_option('--modes', action='store', dest='modes', metavar='LIST',
+                      help='Comma separated modes to run. Default is all: ' + ', '.join(name for name, argv in MODES))
+    options, args = parser.parse_args()
+
+    modes = MODES
+    if options.modes:
+        modes = [(name, argv) for (name, argv) in MODES if name in options.modes.split(',')]
+    baseline = None
+    if options.compare:
+        with open(options.compare) as fs:
+            baseline = json.load(fs)
+
+    with open(os.devnull, 'wb') as sink:
+        results = run(make_corpus(), modes, options.repeat, sink)
+    regressions = print_results(results, baseline, options.threshold / 100.)
+    if options.save:
+        with open(options.save, 'w') as fs:
+            json.dump(results, fs, indent=2, sort_keys=True)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import os
+import hashlib
+import tempfile
+
+
+def get_cache_dir(subdir=None):
+    '''
+    Returns the directory used for files that persist between runs, or the named subdirectory
+    of it, creating it if needed. Can be overridden with the TERMIMAGE_CACHE environment variable.
+    '''
+    path = os.environ.get('TERMIMAGE_CACHE') or os.path.join(os.path.expanduser('~'), '.cache', 'termimage')
+    if subdir:
+        path = os.path.join(path, subdir)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+def write_atomic(path, data):
+    '''
+    Writes data to path through a temporary file so readers never see a partial file
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as fs:
+            fs.write(data)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def render_key(data, settings):
+    '''
+    Returns the cache key for rendering the image bytes data with the given settings.
+    settings must be a sequence of (name, value) pairs covering every option that affects output.
+    '''
+    digest = hashlib.sha1(data)
+    digest.update(repr(sorted(settings)))
+    return digest.hexdigest()
+
+
+def get_render(key):
+    '''
+    Returns the cached output for key, or None. A hit marks the entry as recently used.
+    Without a usable cache directory every key misses.
+    '''
+    try:
+        path = os.path.join(get_cache_dir('renders'), key)
+        with open(path, 'rb') as fs:
+            output = fs.read()
+        os.utime(path, None)
+    except (IOError, OSError):
+        return None
+    return output
+
+
+def put_render(key, output, max_size):
+    '''
+    Stores the output for key, then evicts the least recently used entries until the
+    cache is no larger than max_size bytes. Nothing is stored without a usable cache directory.
+    '''
+    try:
+        render_dir = get_cache_dir('renders')
+        write_atomic(os.path.join(render_dir, key), output)
+    except (IOError, OSError):
+        return
+    evict(render_dir, max_size)
+
+
+def evict(directory, max_size):
+    '''
+    Removes the least recently used files in directory until it is no larger than max_size bytes
+    '''
+    entries = []
+    for name in os.listdir(directory):
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for (mtime, size, name) in entries)
+    for mtime, size, name in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+        total -= size
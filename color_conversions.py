@@ -1,3 +1,9 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
 def rgb_to_xyz(R, G, B):
     '''From http://www.easyrgb.com/index.php?X=MATH'''
     var_R = (R / 255.)
@@ -62,3 +68,49 @@ def rgb_to_cielab(R, G, B):
     CIE_L, CIE_a, CIE_b = xyz_to_cielab(X, Y, Z)
     return CIE_L, CIE_a, CIE_b
 
+
+def rgb_to_xyz_array(rgb):
+    '''Array version of rgb_to_xyz for anything whose last axis is R, G, B. Requires numpy.'''
+    var = numpy.asarray(rgb, dtype=numpy.float64) / 255.
+    var = numpy.where(var > 0.04045, ((var + 0.055) / 1.055) ** 2.4, var / 12.92) * 100
+    var_R, var_G, var_B = var[..., 0], var[..., 1], var[..., 2]
+
+    X = var_R * 0.4124 + var_G * 0.3576 + var_B * 0.1805
+    Y = var_R * 0.2126 + var_G * 0.7152 + var_B * 0.0722
+    Z = var_R * 0.0193 + var_G * 0.1192 + var_B * 0.9505
+
+    return numpy.stack((X, Y, Z), axis=-1)
+
+def xyz_to_cielab_array(xyz):
+    '''Array version of xyz_to_cielab for anything whose last axis is X, Y, Z. Requires numpy.'''
+    var = numpy.asarray(xyz, dtype=numpy.float64) / (95.047, 100.000, 108.883)
+    var = numpy.where(var > 0.008856, var ** (1./3.), (7.787 * var) + (16. / 116.))
+    var_X, var_Y, var_Z = var[..., 0], var[..., 1], var[..., 2]
+
+    CIE_L = (116 * var_Y) - 16.
+    CIE_a = 500. * (var_X - var_Y)
+    CIE_b = 200. * (var_Y - var_Z)
+
+    return numpy.stack((CIE_L, CIE_a, CIE_b), axis=-1)
+
+def rgb_to_cielab_array(rgb):
+    '''Converts a whole H x W x 3 image buffer (or any ... x 3 array) to CIELAB in one call'''
+    return xyz_to_cielab_array(rgb_to_xyz_array(rgb))
+
+
+def lightness_to_luminance(L):
+    '''Returns the luminance Y (0-100) that has the CIELAB lightness L; the inverse of xyz_to_cielab for L'''
+    if L > 8:
+        return 100 * ((L + 16) / 116.) ** 3
+    return 100 * L / 903.3
+
+
+def linearize(value):
+    '''Returns the linear-light value (0-100) rgb_to_xyz uses for an 8-bit channel value'''
+    var = value / 255.
+    if var > 0.04045:
+        return ((var + 0.055) / 1.055) ** 2.4 * 100
+    return var / 12.92 * 100
+
+# The linear-light value of every 8-bit channel value
+LINEAR = [linearize(value) for value in range(256)]
@@ -0,0 +1,225 @@
+'''
+Color distance metrics in CIELAB, used to find the palette entry nearest to a color.
+
+cie76 is the plain Euclidean distance. cie94 is the weighted distance termimage has always used:
+CIE94 with the chroma weight taken from the color being matched and the hue weight from the
+palette entry. ciede2000 is the current CIE formula, the most uniform and the slowest.
+
+Single colors are matched with an early exit. The palette is sorted by lightness and searched
+outward from the lightness of the color. Every metric is at least the lightness difference
+divided by a fixed scale, so the search stops as soon as that bound alone is worse than the
+nearest entry found; for the 256 color palette only a few dozen entries are usually compared.
+Arrays of colors are compared against the whole palette at once with numpy instead.
+'''
+from bisect import bisect_left
+from math import sqrt, atan2, degrees, radians, sin, cos, exp
+import color_conversions
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_METRIC = 'cie94'
+# Number of color/palette distances evaluated at once by nearest_array
+CHUNK_SIZE = 1 << 20
+
+_metrics = {}
+
+
+class Metric(object):
+    # The lightness difference divided by this is a lower bound of the distance
+    lightness_scale = 1.0
+
+    def __init__(self, lab_values):
+        '''
+        lab_values are the CIELAB values of the palette
+        '''
+        self.lab_values = lab_values
+        self.order = sorted(range(len(lab_values)), key=lambda index: lab_values[index][0])
+        self.lightness = [lab_values[index][0] for index in self.order]
+
+    def prepare(self, l1, a1, b1):
+        '''
+        Returns whatever distance needs about the color being matched, computed once per color
+        '''
+        return l1, a1, b1
+
+    def distance(self, color, index):
+        '''
+        Returns the squared distance between a prepared color and a palette entry
+        '''
+        raise NotImplementedError
+
+    def distances(self, lab):
+        '''
+        Returns the N x palette array of squared distances for an N x 3 array of colors
+        '''
+        raise NotImplementedError
+
+    def nearest(self, l1, a1, b1):
+        '''
+        Returns the index of the palette entry nearest to a CIELAB color. Of equally near entries
+        the first one in the palette wins.
+        '''
+        color = self.prepare(l1, a1, b1)
+        lightness = self.lightness
+        count = len(lightness)
+        lower = bisect_left(lightness, l1) - 1
+        upper = lower + 1
+        best = best_index = None
+        while lower >= 0 or upper < count:
+            if upper >= count or (lower >= 0 and l1 - lightness[lower] <= lightness[upper] - l1):
+                position = lower
+                lower -= 1
+            else:
+                position = upper
+                upper += 1
+            bound = (l1 - lightness[position]) / self.lightness_scale
+            if best is not None and bound * bound > best:
+                # Every entry left is even further away in lightness
+                break
+            index = self.order[position]
+            d = self.distance(color, index)
+            if best is None or d < best or (d == best and index < best_index):
+                best = d
+                best_index = index
+        return best_index
+
+    def nearest_array(self, lab):
+        '''
+        Array version of nearest for a ... x 3 array of CIELAB colors. Requires numpy.
+        '''
+        flat = numpy.asarray(lab, dtype=numpy.float64).reshape(-1, 3)
+        result = numpy.empty(len(flat), dtype=numpy.intp)
+        step = max(1, CHUNK_SIZE // len(self.lab_values))
+        for start in range(0, len(flat), step):
+            result[start:start + step] = self.distances(flat[start:start + step]).argmin(axis=1)
+        return result.reshape(lab.shape[:-1])
+
+
+class CIE76(Metric):
+    def distance(self, color, index):
+        l1, a1, b1 = color
+        l2, a2, b2 = self.lab_values[index]
+        return (l1 - l2) ** 2 + (a1 - a2) ** 2 + (b1 - b2) ** 2
+
+    def distances(self, lab):
+        palette = numpy.asarray(self.lab_values, dtype=numpy.float64)
+        return ((lab[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2)
+
+
+class CIE94(Metric):
+    def __init__(self, lab_values):
+        Metric.__init__(self, lab_values)
+        self.chroma = [sqrt(a ** 2 + b ** 2) for (l, a, b) in lab_values]
+        self.hue_weight = [(1 + 0.015 * c2) ** 2 for c2 in self.chroma]
+
+    def prepare(self, l1, a1, b1):
+        c1 = sqrt(a1 ** 2 + b1 ** 2)
+        return l1, a1, b1, c1, 1 + 0.045 * c1
+
+    def distance(self, color, index):
+        l1, a1, b1, c1, chroma_weight = color
+        l2, a2, b2 = self.lab_values[index]
+        dC = c1 - self.chroma[index]
+        dH = (a1 - a2) ** 2 + (b1 - b2) ** 2 - dC ** 2
+        return (l1 - l2) ** 2 + (dC / chroma_weight) ** 2 + dH / self.hue_weight[index]
+
+    def distances(self, lab):
+        palette = numpy.asarray(self.lab_values, dtype=numpy.float64)
+        l2, a2, b2 = palette[:, 0], palette[:, 1], palette[:, 2]
+        c2 = numpy.sqrt(a2 ** 2 + b2 ** 2)
+        l1, a1, b1 = lab[:, 0, None], lab[:, 1, None], lab[:, 2, None]
+        c1 = numpy.sqrt(a1 ** 2 + b1 ** 2)
+        dC = c1 - c2
+        dH = (a1 - a2) ** 2 + (b1 - b2) ** 2 - dC ** 2
+        return (l1 - l2) ** 2 + (dC / (1 + 0.045 * c1)) ** 2 + dH / (1 + 0.015 * c2) ** 2
+
+
+class CIEDE2000(Metric):
+    # The lightness weight is largest for a mean lightness of 0 or 100, and the remaining terms
+    # never add up to less than 0
+    lightness_scale = 1 + 0.015 * 50 ** 2 / sqrt(20 + 50 ** 2)
+
+    def prepare(self, l1, a1, b1):
+        return l1, a1, b1, sqrt(a1 ** 2 + b1 ** 2)
+
+    def distance(self, color, index):
+        l1, a1, b1, c1 = color
+        l2, a2, b2 = self.lab_values[index]
+        c7 = ((c1 + sqrt(a2 ** 2 + b2 ** 2)) / 2) ** 7
+        g = 1.5 - 0.5 * sqrt(c7 / (c7 + 25 ** 7))
+        a1, a2 = a1 * g, a2 * g
+        c1p, c2p = sqrt(a1 ** 2 + b1 ** 2), sqrt(a2 ** 2 + b2 ** 2)
+        h1p = degrees(atan2(b1, a1)) % 360 if c1p else 0.0
+        h2p = degrees(atan2(b2, a2)) % 360 if c2p else 0.0
+        dLp = l2 - l1
+        dCp = c2p - c1p
+        dhp = h2p - h1p
+        hp = h1p + h2p
+        if not (c1p and c2p):
+            dhp = 0.0
+        elif dhp > 180:
+            dhp -= 360
+            hp += 360 if hp < 360 else -360
+        elif dhp < -180:
+            dhp += 360
+            hp += 360 if hp < 360 else -360
+        dHp = 2 * sqrt(c1p * c2p) * sin(radians(dhp) / 2)
+        mean_l = (l1 + l2) / 2. - 50
+        mean_cp = (c1p + c2p) / 2.
+        mean_hp = hp / 2. if c1p and c2p else hp
+        t = (1 - 0.17 * cos(radians(mean_hp - 30)) + 0.24 * cos(radians(2 * mean_hp)) +
+             0.32 * cos(radians(3 * mean_hp + 6)) - 0.20 * cos(radians(4 * mean_hp - 63)))
+        cp7 = mean_cp ** 7
+        rt = -2 * sqrt(cp7 / (cp7 + 25 ** 7)) * sin(radians(60 * exp(-((mean_hp - 275) / 25.) ** 2)))
+        sl = 1 + 0.015 * mean_l ** 2 / sqrt(20 + mean_l ** 2)
+        sc = 1 + 0.045 * mean_cp
+        sh = 1 + 0.015 * mean_cp * t
+        return (dLp / sl) ** 2 + (dCp / sc) ** 2 + (dHp / sh) ** 2 + rt * (dCp / sc) * (dHp / sh)
+
+    def distances(self, lab):
+        palette = numpy.asarray(self.lab_values, dtype=numpy.float64)
+        l2, a2, b2 = palette[:, 0], palette[:, 1], palette[:, 2]
+        l1, a1, b1 = lab[:, 0, None], lab[:, 1, None], lab[:, 2, None]
+        c7 = ((numpy.sqrt(a1 ** 2 + b1 ** 2) + numpy.sqrt(a2 ** 2 + b2 ** 2)) / 2) ** 7
+        g = 1.5 - 0.5 * numpy.sqrt(c7 / (c7 + 25 ** 7))
+        a1, a2 = a1 * g, a2 * g
+        c1p, c2p = numpy.sqrt(a1 ** 2 + b1 ** 2), numpy.sqrt(a2 ** 2 + b2 ** 2)
+        h1p = numpy.where(c1p != 0, numpy.degrees(numpy.arctan2(b1, a1)) % 360, 0.0)
+        h2p = numpy.where(c2p != 0, numpy.degrees(numpy.arctan2(b2, a2)) % 360, 0.0)
+        chromatic = (c1p * c2p) != 0
+        dhp = h2p - h1p
+        hp = h1p + h2p
+        wrapped = chromatic & (numpy.abs(dhp) > 180)
+        dhp = numpy.where(chromatic, dhp - 360 * numpy.sign(dhp) * wrapped, 0.0)
+        hp = hp + numpy.where(wrapped, numpy.where(hp < 360, 360, -360), 0)
+        dHp = 2 * numpy.sqrt(c1p * c2p) * numpy.sin(numpy.radians(dhp) / 2)
+        mean_l = (l1 + l2) / 2. - 50
+        mean_cp = (c1p + c2p) / 2.
+        mean_hp = numpy.where(chromatic, hp / 2., hp)
+        t = (1 - 0.17 * numpy.cos(numpy.radians(mean_hp - 30)) + 0.24 * numpy.cos(numpy.radians(2 * mean_hp)) +
+             0.32 * numpy.cos(numpy.radians(3 * mean_hp + 6)) - 0.20 * numpy.cos(numpy.radians(4 * mean_hp - 63)))
+        cp7 = mean_cp ** 7
+        rt = -2 * numpy.sqrt(cp7 / (cp7 + 25 ** 7)) * numpy.sin(numpy.radians(60 * numpy.exp(-((mean_hp - 275) / 25.) ** 2)))
+        sl = 1 + 0.015 * mean_l ** 2 / numpy.sqrt(20 + mean_l ** 2)
+        sc = 1 + 0.045 * mean_cp
+        sh = 1 + 0.015 * mean_cp * t
+        dC = (c2p - c1p) / sc
+        dH = dHp / sh
+        return ((l2 - l1) / sl) ** 2 + dC ** 2 + dH ** 2 + rt * dC * dH
+
+
+METRICS = {'cie76': CIE76, 'cie94': CIE94, 'ciede2000': CIEDE2000}
+
+
+def get_metric(name, rgb_values):
+    '''
+    Returns the metric called name set up for a palette, creating it once per process
+    '''
+    key = (name, tuple(rgb_values))
+    if key not in _metrics:
+        lab_values = [color_conversions.rgb_to_cielab(r, g, b) for (r, g, b) in rgb_values]
+        _metrics[key] = METRICS[name](lab_values)
+    return _metrics[key]
@@ -0,0 +1,90 @@
+'''
+Dithering directly against the active palette, producing palette indices.
+
+ErrorDiffusion is Floyd-Steinberg: each pixel is matched and the difference between it and the
+palette color it got is pushed onto its unmatched neighbours. Rows are fed in order and only the
+error carried into the next row is kept, so it works on bands while streaming. The ordered
+functions add a Bayer threshold pattern to the pixels before matching, which needs no state and
+vectorizes with numpy.
+'''
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def bayer_matrix(size):
+    '''
+    Returns the size x size Bayer threshold matrix, size being a power of two
+    '''
+    matrix = [[0]]
+    while len(matrix) < size:
+        matrix = ([[4 * v for v in row] + [4 * v + 2 for v in row] for row in matrix] +
+                  [[4 * v + 3 for v in row] + [4 * v + 1 for v in row] for row in matrix])
+    return matrix
+
+BAYER = bayer_matrix(8)
+# Threshold offsets in the range -0.5 to 0.5
+BAYER_OFFSETS = [[(v + 0.5) / 64 - 0.5 for v in row] for row in BAYER]
+
+
+def get_spread(rgb_values):
+    '''
+    Returns the strength of ordered dithering for a palette, which is roughly the distance between
+    neighbouring colors of a palette spread evenly over the RGB cube
+    '''
+    return 256. / len(rgb_values) ** (1 / 3.)
+
+
+class ErrorDiffusion(object):
+    def __init__(self, rgb_values, match):
+        '''
+        rgb_values is the active palette and match(r, g, b) returns the index of the nearest entry
+        '''
+        self.rgb_values = rgb_values
+        self.match = match
+        self.errors = None
+
+    def dither_row(self, row):
+        '''
+        Returns the palette indices of the next row of (r, g, b) pixels
+        '''
+        width = len(row)
+        # One cell of padding on either side keeps the neighbours of the edge pixels in range
+        current = self.errors or [[0.0] * (width + 2) for channel in range(3)]
+        following = [[0.0] * (width + 2) for channel in range(3)]
+        indices = []
+        for x in range(width):
+            values = [min(255, max(0, int(row[x][channel] + current[channel][x + 1] + 0.5))) for channel in range(3)]
+            index = self.match(*values)
+            target = self.rgb_values[index]
+            for channel in range(3):
+                error = values[channel] - target[channel]
+                current[channel][x + 2] += error * (7 / 16.)
+                following[channel][x] += error * (3 / 16.)
+                following[channel][x + 1] += error * (5 / 16.)
+                following[channel][x + 2] += error * (1 / 16.)
+            indices.append(index)
+        self.errors = following
+        return indices
+
+
+def ordered_row(row, y, spread):
+    '''
+    Returns the row of (r, g, b) pixels at image row y with the Bayer pattern applied
+    '''
+    offsets = BAYER_OFFSETS[y % 8]
+    result = []
+    for x, pixel in enumerate(row):
+        offset = offsets[x % 8] * spread
+        result.append(tuple(min(255, max(0, int(value + offset + 0.5))) for value in pixel))
+    return result
+
+
+def ordered_array(pixels, ys, spread):
+    '''
+    Array version of ordered_row for an N x W x 3 array holding the image rows ys. Requires numpy.
+    '''
+    width = pixels.shape[1]
+    offsets = numpy.array(BAYER_OFFSETS)[numpy.asarray(ys) % 8][:, numpy.arange(width) % 8] * spread
+    return numpy.clip(pixels + offsets[..., None] + 0.5, 0, 255).astype(numpy.uint8)
@@ -0,0 +1,214 @@
+'''
+HTTP downloads over persistent connections, with timeouts, size limits and conditional requests.
+'''
+import os
+import json
+import socket
+import hashlib
+import httplib
+import threading
+import urlparse
+import itertools
+import collections
+from multiprocessing.pool import ThreadPool
+import cache
+
+USER_AGENT = 'pjaeBot'
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_MAX_SIZE = 20 * 1024 * 1024
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+MAX_REDIRECTS = 5
+READ_SIZE = 64 * 1024
+
+
+class FetchError(IOError):
+    pass
+
+
+class ConnectionPool(object):
+    '''
+    Keeps idle HTTP connections per host so following requests to it skip the TCP and TLS handshakes
+    '''
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc, timeout):
+        '''
+        Returns (connection, reused), with an idle connection to the host if there is one
+        '''
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                conn = idle.pop()
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=timeout), False
+        return httplib.HTTPConnection(netloc, timeout=timeout), False
+
+    def put(self, scheme, netloc, conn):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+default_pool = ConnectionPool()
+
+
+def request(pool, url, headers, timeout, max_size):
+    '''
+    Performs a single GET and returns (status, headers, body). Header names are lower case.
+    '''
+    parts = urlparse.urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise FetchError('Unsupported URL: %s' % url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    while True:
+        conn = None
+        reused = False
+        try:
+            # Building a connection parses the host and port, which raises InvalidURL for bad ones
+            conn, reused = pool.get(parts.scheme, parts.netloc, timeout)
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            break
+        except (httplib.HTTPException, socket.error) as e:
+            if conn is not None:
+                conn.close()
+            # An idle connection may have been closed by the server in the meantime
+            if not reused:
+                raise FetchError('%s: %s' % (url, e))
+    try:
+        length = response.getheader('content-length', '')
+        if length.isdigit() and int(length) > max_size:
+            raise FetchError('%s is larger than %d bytes' % (url, max_size))
+        chunks = []
+        size = 0
+        while True:
+            chunk = response.read(READ_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise FetchError('%s is larger than %d bytes' % (url, max_size))
+            chunks.append(chunk)
+    except (FetchError, httplib.HTTPException, socket.error) as e:
+        conn.close()
+        if isinstance(e, FetchError):
+            raise
+        raise FetchError('%s: %s' % (url, e))
+    if response.will_close:
+        conn.close()
+    else:
+        pool.put(parts.scheme, parts.netloc, conn)
+    return response.status, dict(response.getheaders()), ''.join(chunks)
+
+
+def cache_path(url):
+    return os.path.join(cache.get_cache_dir('downloads'), hashlib.sha1(url).hexdigest())
+
+
+def load_cached(url):
+    '''
+    Returns (validators, body) of the cached download of url, or (None, None)
+    '''
+    try:
+        with open(cache_path(url), 'rb') as fs:
+            validators = json.loads(fs.readline())
+            return validators, fs.read()
+    except (IOError, OSError, ValueError):
+        return None, None
+
+
+def store_cached(url, validators, body, cache_size):
+    try:
+        path = cache_path(url)
+        cache.write_atomic(path, json.dumps(validators) + '\n' + body)
+    except (IOError, OSError):
+        return
+    cache.evict(os.path.dirname(path), cache_size)
+
+
+def fetch(url, timeout=DEFAULT_TIMEOUT, max_size=DEFAULT_MAX_SIZE, cache_size=DEFAULT_CACHE_SIZE, pool=None):
+    '''
+    Downloads url and returns the body. Connections are reused through pool, which defaults to a
+    shared module-level pool. Responses carrying an ETag or Last-Modified header are cached, up to
+    cache_size bytes in total, and revalidated with a conditional GET the next time, so an unchanged
+    image costs a 304 instead of a download. A cache_size of 0 disables this.
+    '''
+    pool = pool or default_pool
+    headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'identity'}
+    validators, cached_body = load_cached(url) if cache_size else (None, None)
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last-modified'):
+            headers['If-Modified-Since'] = validators['last-modified']
+    location = url
+    for redirect in range(MAX_REDIRECTS + 1):
+        status, response_headers, body = request(pool, location, headers, timeout, max_size)
+        if status not in (301, 302, 303, 307, 308) or 'location' not in response_headers:
+            break
+        location = urlparse.urljoin(location, response_headers['location'])
+    else:
+        raise FetchError('%s: too many redirects' % url)
+    if status == 304 and validators:
+        try:
+            os.utime(cache_path(url), None)
+        except OSError:
+            pass
+        return cached_body
+    if status != 200:
+        raise FetchError('%s: HTTP %d' % (url, status))
+    if cache_size:
+        validators = dict((name, response_headers[name]) for name in ('etag', 'last-modified')
+                          if name in response_headers)
+        if validators:
+            store_cached(url, validators, body, cache_size)
+    return body
+
+
+def fetch_all(urls, workers=8, ahead=None, **kwargs):
+    '''
+    Downloads urls concurrently on a pool of threads sharing connections. Yields
+    (url, body, error) in the order of urls; exactly one of body and error is None.
+    No more than ahead downloads, twice workers by default, are started or held before their
+    results are taken, so the bodies in memory stay bounded however many urls there are.
+    Keyword arguments are passed on to fetch.
+    '''
+    def fetch_one(url):
+        try:
+            return url, fetch(url, **kwargs), None
+        except (IOError, OSError) as e:
+            return url, None, str(e)
+
+    urls = iter(urls)
+    threads = ThreadPool(workers)
+    pending = collections.deque()
+    try:
+        for url in itertools.islice(urls, ahead or 2 * workers):
+            pending.append(threads.apply_async(fetch_one, (url,)))
+        while pending:
+            result = pending.popleft().get()
+            for url in itertools.islice(urls, 1):
+                pending.append(threads.apply_async(fetch_one, (url,)))
+            yield result
+    finally:
+        threads.close()
+        threads.join()
@@ -0,0 +1,192 @@
+'''
+Encodes rows of palette indices into output lines using as few bytes as possible.
+
+A color code is only written when a cell needs a color that is not already set, and then the
+shortest one that works: foreground only, background only or both. In hires mode each cell can be
+drawn as an upper half block with the top color in front or as a lower half block with the colors
+swapped, and cells whose halves match can be a space on the background or a full block in the
+foreground. The encoder picks, cell by cell, whichever of those costs the fewest bytes from the
+colors already set.
+'''
+
+UPPER_HALF = u'\u2580'
+LOWER_HALF = u'\u2584'
+FULL_BLOCK = u'\u2588'
+REPEAT = u'\033[{0}b'
+
+CHAR_BYTES = {u' ': 1, UPPER_HALF: 3, LOWER_HALF: 3, FULL_BLOCK: 3}
+
+# The color code templates of every output target. IRC has no code that sets only the background.
+TEMPLATES = {
+    'ansi': {'both': '\033[{0};{1}m', 'fore': '\033[{0}m', 'back': '\033[{1}m'},
+    'xterm': {'both': '\033[38;5;{0};48;5;{1}m', 'fore': '\033[38;5;{0}m', 'back': '\033[48;5;{1}m'},
+    'xterm-bw': {'both': '\033[38;5;{0};48;5;{1}m', 'fore': '\033[38;5;{0}m', 'back': '\033[48;5;{1}m'},
+    'irc': {'both': '\x03{0},{1}', 'fore': '\x03{0}', 'back': None},
+    'truecolor': {'both': '\033[38;2;{0};48;2;{1}m', 'fore': '\033[38;2;{0}m', 'back': '\033[48;2;{1}m'},
+}
+
+index_to_ansi_front = [
+    '30',
+    '31',
+    '32',
+    '33',
+    '34',
+    '35',
+    '36',
+    '37',
+    '30;1',
+    '31;1',
+    '32;1',
+    '33;1',
+    '34;1',
+    '35;1',
+    '36;1',
+    '37;1'
+]
+
+index_to_ansi_back = [
+    '40',
+    '41',
+    '42',
+    '43',
+    '44',
+    '45',
+    '46',
+    '47',
+    '40;1',
+    '41;1',
+    '42;1',
+    '43;1',
+    '44;1',
+    '45;1',
+    '46;1',
+    '47;1'
+]
+
+
+def get_code(target, index, back=False):
+    '''
+    Returns the color code target's template expects for a palette index, or for a packed
+    0xRRGGBB value in truecolor. The black and white xterm palette is the grays from 232 up.
+    '''
+    if target == 'truecolor':
+        return '%d;%d;%d' % (index >> 16, index >> 8 & 0xff, index & 0xff)
+    elif target == 'xterm-bw':
+        return index + 232
+    elif target == 'ansi':
+        if back:
+            return index_to_ansi_back[index]
+        return index_to_ansi_front[index]
+    return index
+
+
+def get_encoder(target, repeat=False):
+    '''
+    Returns an Encoder for one of the TEMPLATES targets. Lines are reset at the end except on IRC,
+    which also has no REP sequence.
+    '''
+    return Encoder(TEMPLATES[target], lambda index, back=False: get_code(target, index, back),
+                   u'' if target == 'irc' else u'\033[0m', repeat and target != 'irc')
+
+
+class Encoder(object):
+    def __init__(self, template, get_code, reset=u'', repeat=False):
+        '''
+        template holds 'both', 'fore' and 'back' format strings taking the foreground code as {0}
+        and the background code as {1}; 'back' is None for outputs that can not set the background
+        on its own. get_code(index, back) returns the code of a palette index. reset is appended to
+        every line. With repeat, runs of a character are shortened with the REP control sequence,
+        which not every terminal supports.
+        '''
+        self.template = template
+        self.get_code = get_code
+        self.reset = reset
+        self.repeat = repeat
+        self._codes = {}
+
+    def format(self, kind, fore, back):
+        key = (kind, fore, back)
+        if key not in self._codes:
+            self._codes[key] = self.template[kind].format(
+                self.get_code(fore) if fore is not None else '',
+                self.get_code(back, back=True) if back is not None else '')
+        return self._codes[key]
+
+    def transition(self, fore, back, want_fore, want_back):
+        '''
+        Returns (code, fore, back): the shortest code that takes the current colors to the wanted
+        ones, and the colors set afterwards. A wanted color of None means any color will do.
+        '''
+        need_fore = want_fore is not None and want_fore != fore
+        need_back = want_back is not None and want_back != back
+        if need_back and not need_fore and self.template['back'] is None:
+            need_fore = True
+            if want_fore is None:
+                # Any foreground will do, so the one with the shortest code is set: the current
+                # one, the background or index 0, preferring them in that order
+                choices = [want_back, 0] if fore is None else [fore, want_back, 0]
+                want_fore = min(choices, key=lambda index: len(self.format('fore', index, None)))
+        if need_fore and need_back:
+            return self.format('both', want_fore, want_back), want_fore, want_back
+        elif need_fore:
+            return self.format('fore', want_fore, None), want_fore, back
+        elif need_back:
+            return self.format('back', None, want_back), fore, want_back
+        return '', fore, back
+
+    def encode_line(self, top, bottom=None):
+        '''
+        Encodes one line. Without bottom every cell is a space on the color in top, otherwise
+        cells are split into the top and bottom colors.
+        '''
+        parts = []
+        fore = back = None
+        run_char = None
+        run_length = 0
+        for x in range(len(top)):
+            upper = top[x]
+            if bottom is None:
+                candidates = ((u' ', None, upper),)
+            elif upper == bottom[x]:
+                candidates = ((u' ', None, upper), (FULL_BLOCK, upper, None))
+            else:
+                candidates = ((UPPER_HALF, upper, bottom[x]), (LOWER_HALF, bottom[x], upper))
+            best = None
+            for char, want_fore, want_back in candidates:
+                code, new_fore, new_back = self.transition(fore, back, want_fore, want_back)
+                cost = len(code) + CHAR_BYTES[char]
+                if best is None or cost < best[0]:
+                    best = (cost, char, code, new_fore, new_back)
+            cost, char, code, fore, back = best
+            if not code and char == run_char:
+                run_length += 1
+                continue
+            self.end_run(parts, run_char, run_length)
+            parts.append(code)
+            parts.append(char)
+            run_char = char
+            run_length = 0
+        self.end_run(parts, run_char, run_length)
+        parts.append(self.reset)
+        return u''.join(parts)
+
+    def end_run(self, parts, char, length):
+        '''
+        Appends the repetitions of char that follow its first occurrence
+        '''
+        if not length:
+            return
+        if self.repeat and len(REPEAT.format(length)) < length * CHAR_BYTES[char]:
+            parts.append(REPEAT.format(length))
+        else:
+            parts.append(char * length)
+
+
+def get_stats(sizes):
+    '''
+    Returns a summary of the byte counts of the output rows
+    '''
+    if not sizes:
+        return 'rows: 0'
+    return 'rows: %d, bytes: %d, bytes per row: min %d, mean %.1f, max %d' % (
+        len(sizes), sum(sizes), min(sizes), float(sum(sizes)) / len(sizes), max(sizes))
@@ -0,0 +1,117 @@
+'''
+Output formats other than terminal text, made from the same rows of palette indices.
+
+HTMLEncoder writes each line as spans of cells that share their colors, with CSS classes per
+palette index (f<index> for the foreground, b<index> for the background) defined once by
+get_stylesheet. Truecolor rows have no palette, so their spans carry the colors inline. Like the
+terminal encoder it picks, cell by cell, whichever character keeps the current span going:
+a space or a full block for cells whose halves match, and an upper or lower half block for cells
+whose halves differ.
+
+render_png draws the cells as blocks of pixels, the top and bottom halves of every cell taking
+the colors of the two rows it was made from.
+'''
+import Image
+from cStringIO import StringIO
+from encoder import UPPER_HALF, LOWER_HALF, FULL_BLOCK
+
+HTML_FOOTER = '</pre>\n'
+
+
+def get_stylesheet(rgb_values, high_res=False):
+    '''
+    Returns the style element defining the color classes of a palette. Backgrounds are enough
+    outside hires mode.
+    '''
+    rules = ['.termimage{line-height:1;letter-spacing:0}']
+    for index, (r, g, b) in enumerate(rgb_values):
+        if high_res:
+            rules.append('.f%d{color:#%02x%02x%02x}' % (index, r, g, b))
+        rules.append('.b%d{background:#%02x%02x%02x}' % (index, r, g, b))
+    return '<style>%s</style>\n' % ''.join(rules)
+
+
+def get_html_header(rgb_values, high_res=False):
+    '''
+    Returns what comes before the first line; rgb_values is None for truecolor rows
+    '''
+    stylesheet = get_stylesheet(rgb_values, high_res) if rgb_values is not None else ''
+    return stylesheet + '<pre class="termimage">\n'
+
+
+class HTMLEncoder(object):
+    def __init__(self, truecolor=False):
+        '''
+        With truecolor the rows hold packed 0xRRGGBB values instead of palette indices
+        '''
+        self.truecolor = truecolor
+
+    def attributes(self, fore, back):
+        if self.truecolor:
+            styles = ['background:#%06x' % back]
+            if fore is not None:
+                styles.insert(0, 'color:#%06x' % fore)
+            return u' style="%s"' % ';'.join(styles)
+        classes = ['b%d' % back]
+        if fore is not None:
+            classes.insert(0, 'f%d' % fore)
+        return u' class="%s"' % ' '.join(classes)
+
+    def encode_line(self, top, bottom=None):
+        '''
+        Encodes one line. Without bottom every cell is a space on the color in top, otherwise
+        cells are split into the top and bottom colors.
+        '''
+        parts = []
+        fore = back = None
+        text = []
+        for x in range(len(top)):
+            upper = top[x]
+            lower = upper if bottom is None else bottom[x]
+            if upper != lower:
+                if text and (fore, back) == (lower, upper):
+                    cell = (LOWER_HALF, lower, upper)
+                else:
+                    cell = (UPPER_HALF, upper, lower)
+            elif text and upper == back:
+                cell = (u' ', fore, back)
+            elif text and upper == fore:
+                cell = (FULL_BLOCK, fore, back)
+            else:
+                cell = (u' ', None, upper)
+            char, want_fore, want_back = cell
+            if text and (want_fore, want_back) != (fore, back):
+                self.end_span(parts, fore, back, text)
+                text = []
+            fore, back = want_fore, want_back
+            text.append(char)
+        self.end_span(parts, fore, back, text)
+        return u''.join(parts)
+
+    def end_span(self, parts, fore, back, text):
+        if text:
+            parts.append(u'<span%s>%s</span>' % (self.attributes(fore, back), u''.join(text)))
+
+
+def render_png(rows, rgb_values, cell_width, cell_height):
+    '''
+    Returns a PNG of (top, bottom) index row pairs, bottom being None outside hires mode, with
+    every cell cell_width x cell_height pixels. rgb_values is None for truecolor rows.
+    '''
+    width = len(rows[0][0]) if rows else 0
+    data = []
+    for top, bottom in rows:
+        data.extend(top)
+        data.extend(bottom if bottom is not None else top)
+    size = (max(width, 1), max(2 * len(rows), 1))
+    if rgb_values is None:
+        im = Image.new('RGB', size)
+        im.putdata([(value >> 16, value >> 8 & 0xff, value & 0xff) for value in data])
+    else:
+        im = Image.new('P', size)
+        im.putpalette([channel for color in rgb_values for channel in color])
+        im.putdata(data)
+    im = im.resize((size[0] * cell_width, size[1] * cell_height // 2), Image.NEAREST)
+    output = StringIO()
+    im.save(output, 'PNG', optimize=True)
+    return output.getvalue()
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+'''
+A compact binary format for rendered cell grids, and replay of stored grids as terminal or IRC
+text.
+
+A grid holds the palette indices of a render instead of its escape codes, so one stored render
+can be written for any target later. Indices are mapped to the palette of the target when it
+differs from the one the grid was rendered with. Everything here works without PIL, so replaying
+never loads it.
+
+The format, with numbers big-endian:
+
+    magic      4 bytes  'TMGR'
+    version    1 byte
+    palette    1 byte   id of the palette in PALETTES
+    flags      1 byte   HIRES: every line has a bottom row; COMPRESSED: the cells are zlib data
+    width      2 bytes  cells per line
+    lines      2 bytes
+    cells      for every line its top row and, in hires grids, its bottom row, with one byte per
+               cell holding a palette index, or three (R, G, B) for the truecolor palette
+
+    grid.py [-x | -i | -t] [--bw] [--repeat] FILE
+
+replays a stored grid to stdout; FILE '-' is stdin.
+'''
+import sys
+import zlib
+import struct
+from array import array
+from optparse import OptionParser
+import rgb_values as palettes
+import encoder
+import color_conversions
+import distance
+import lookup_table
+
+MAGIC = 'TMGR'
+VERSION = 1
+HEADER = struct.Struct('>4sBBBHH')
+HIRES = 1
+COMPRESSED = 2
+
+# Palettes by id, with the encoder.TEMPLATES target each is written for; truecolor has none
+PALETTES = {
+    0: ('ansi', palettes.default_rgb_values),
+    1: ('ansi', palettes.default_rgb_values[:8]),
+    2: ('xterm', palettes.default_rgb_values + palettes.xterm_rgb_values),
+    3: ('xterm-bw', palettes.bw_xterm_rgb_values),
+    4: ('irc', palettes.irc_rgb_values),
+    5: ('truecolor', None),
+}
+TRUECOLOR = 5
+
+
+class Grid(object):
+    def __init__(self, palette, rows):
+        '''
+        palette is an id in PALETTES and rows the (top, bottom) index row pairs of the lines,
+        bottom being None outside hires mode
+        '''
+        self.palette = palette
+        self.rows = rows
+
+    @property
+    def high_res(self):
+        return bool(self.rows) and self.rows[0][1] is not None
+
+    @property
+    def width(self):
+        return len(self.rows[0][0]) if self.rows else 0
+
+
+def find_palette(rgb_values):
+    '''
+    Returns the id of a palette given by its RGB values, or of the truecolor palette for None
+    '''
+    for palette, (target, values) in PALETTES.items():
+        if values == rgb_values:
+            return palette
+    raise ValueError('Not a grid palette')
+
+
+def dumps(grid, compress=False):
+    '''
+    Returns a grid in the binary format, its cells zlib-compressed with compress
+    '''
+    cells = array('B')
+    for top, bottom in grid.rows:
+        for row in (top, bottom) if bottom is not None else (top,):
+            if grid.palette == TRUECOLOR:
+                for value in row:
+                    cells.extend((value >> 16, value >> 8 & 0xff, value & 0xff))
+            else:
+                cells.extend(row)
+    flags = (HIRES if grid.high_res else 0) | (COMPRESSED if compress else 0)
+    data = cells.tostring()
+    if compress:
+        data = zlib.compress(data, 9)
+    return HEADER.pack(MAGIC, VERSION, grid.palette, flags, grid.width, len(grid.rows)) + data
+
+
+def loads(data):
+    '''
+    Returns the Grid stored in data. Raises ValueError for anything that is not a whole grid.
+    '''
+    if len(data) < HEADER.size:
+        raise ValueError('Not a grid')
+    magic, version, palette, flags, width, lines = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or palette not in PALETTES:
+        raise ValueError('Not a grid, or a grid of an unknown version')
+    data = data[HEADER.size:]
+    if flags & COMPRESSED:
+        try:
+            data = zlib.decompress(data)
+        except zlib.error as e:
+            raise ValueError('Damaged grid: %s' % e)
+    cells = array('B', data)
+    cell_bytes = 3 if palette == TRUECOLOR else 1
+    row_bytes = width * cell_bytes
+    rows_per_line = 2 if flags & HIRES else 1
+    if len(cells) != row_bytes * rows_per_line * lines:
+        raise ValueError('Damaged grid: the cells do not match its size')
+    rows = []
+    for start in range(0, len(cells), row_bytes):
+        row = cells[start:start + row_bytes].tolist()
+        if palette == TRUECOLOR:
+            row = [r << 16 | g << 8 | b for (r, g, b) in zip(row[::3], row[1::3], row[2::3])]
+        rows.append(row)
+    if rows_per_line == 2:
+        return Grid(palette, zip(rows[::2], rows[1::2]))
+    return Grid(palette, [(row, None) for row in rows])
+
+
+def get_mapping(source, target):
+    '''
+    Returns a function taking an index of the source palette to the nearest index of the target
+    palette, or a packed RGB value for the truecolor target; None if no mapping is needed.
+    Palette colors are searched for exactly, and truecolor values looked up in the lookup table
+    of the target palette.
+    '''
+    if source == target:
+        return None
+    source_values = PALETTES[source][1]
+    if target == TRUECOLOR:
+        packed = [r << 16 | g << 8 | b for (r, g, b) in source_values]
+        return packed.__getitem__
+    target_values = PALETTES[target][1]
+    if source == TRUECOLOR:
+        table = lookup_table.get_table(target_values)
+        bits = lookup_table.DEFAULT_BITS
+        return lambda value: lookup_table.lookup(table, bits, value >> 16, value >> 8 & 0xff, value & 0xff)
+    metric = distance.get_metric(distance.DEFAULT_METRIC, target_values)
+    return [metric.nearest(*color_conversions.rgb_to_cielab(r, g, b)) for (r, g, b) in source_values].__getitem__
+
+
+def iter_replay(grid, target, repeat=False):
+    '''
+    Yields the lines of a grid written for the target palette id as UTF-8 bytes
+    '''
+    line_encoder = encoder.get_encoder(PALETTES[target][0], repeat)
+    mapping = get_mapping(grid.palette, target)
+    for top, bottom in grid.rows:
+        if mapping is not None:
+            top = map(mapping, top)
+            bottom = map(mapping, bottom) if bottom is not None else None
+        yield line_encoder.encode_line(top, bottom).encode('utf8') + '\n'
+
+
+def get_target(options, high_res):
+    '''
+    Returns the palette id of the target the options select, as termimage picks the palette.
+    Hires grids get the eight color palette on plain terminals, which can not show bright
+    backgrounds.
+    '''
+    if options.irc:
+        return 4
+    elif options.truecolor:
+        return TRUECOLOR
+    elif options.xterm:
+        return 3 if options.black_and_white else 2
+    return 1 if high_res else 0
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog [options] FILE', description='Replays a cell grid stored with termimage.py --format=grid.')
+    parser.add_option('-i', '--irc', action='store_true', dest='irc', default=False,
+                      help='Output using IRC color codes.')
+    parser.add_option('-x', '--xterm', action='store_true', dest='xterm', default=False,
+                      help='Uses xterm 256 colors.')
+    parser.add_option('-t', '--truecolor', action='store_true', dest='truecolor', default=False,
+                      help='Uses 24-bit colors.')
+    parser.add_option('--bw', action='store_true', dest='black_and_white', default=False,
+                      help='Uses the xterm grays.')
+    parser.add_option('--repeat', action='store_true', dest='repeat', default=False,
+                      help='Shorten runs of the same character with the REP sequence.')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('Give one grid file, or - for stdin')
+    try:
+        if args[0] == '-':
+            data = sys.stdin.read()
+        else:
+            with open(args[0], 'rb') as fs:
+                data = fs.read()
+        grid = loads(data)
+    except (IOError, ValueError) as e:
+        sys.exit(e)
+    for line in iter_replay(grid, get_target(options, grid.high_res), options.repeat):
+        sys.stdout.write(line)
@@ -0,0 +1,94 @@
+'''
+Interactive tuning of the contrast and the black and white thresholds.
+
+The image is drawn, followed by a prompt. Every line typed in changes one or more settings and
+redraws the image, and the time the redraw took is shown with the settings:
+
+    c 1.4         contrast
+    b 12          black threshold
+    w 5 c 1.2     white threshold, then contrast
+    r             back to the settings the image was first drawn with
+    q             quit, as does end of input
+
+The caller does the rendering, so only what the settings affect needs to be done again.
+'''
+import time
+
+CLEAR = '\033[2J\033[H'
+PROMPT = '> '
+HELP = 'c CONTRAST, b BLACK, w WHITE (0-100), r to reset, q to quit'
+
+NAMES = {'c': 'contrast', 'contrast': 'contrast',
+         'b': 'black_threshold', 'black': 'black_threshold',
+         'w': 'white_threshold', 'white': 'white_threshold'}
+
+
+def parse_command(line, settings):
+    '''
+    Returns a copy of settings with the changes on a line applied. Raises ValueError for anything
+    that is not a setting name followed by a number.
+    '''
+    words = line.split()
+    if len(words) % 2:
+        raise ValueError(HELP)
+    settings = dict(settings)
+    for name, value in zip(words[::2], words[1::2]):
+        if name.lower() not in NAMES:
+            raise ValueError('Unknown setting: %s. %s' % (name, HELP))
+        try:
+            settings[NAMES[name.lower()]] = float(value)
+        except ValueError:
+            raise ValueError('Not a number: %s' % value)
+    return settings
+
+
+def describe(settings):
+    return 'contrast %g, black %g, white %g' % (
+        settings['contrast'], settings['black_threshold'], settings['white_threshold'])
+
+
+def draw(render, settings, stdout):
+    '''
+    Renders with settings and writes the output and the settings. Returns whether it worked;
+    settings render rejects with ValueError are reported instead.
+    '''
+    start = time.time()
+    try:
+        output = render(settings)
+    except ValueError as e:
+        stdout.write('%s\n' % e)
+        return False
+    elapsed = time.time() - start
+    if stdout.isatty():
+        stdout.write(CLEAR)
+    stdout.write(output)
+    stdout.write('%s: %d ms. %s\n' % (describe(settings), elapsed * 1000, HELP))
+    return True
+
+
+def run(render, settings, stdin, stdout):
+    '''
+    Draws the image with settings, a dict of contrast, black_threshold and white_threshold, and
+    redraws it with every change read from stdin. render(settings) returns the output.
+    '''
+    initial = settings
+    draw(render, settings, stdout)
+    while True:
+        stdout.write(PROMPT)
+        stdout.flush()
+        line = stdin.readline()
+        if not line or line.strip().lower() in ('q', 'quit'):
+            break
+        if not line.strip():
+            continue
+        if line.strip().lower() in ('r', 'reset'):
+            changed = initial
+        else:
+            try:
+                changed = parse_command(line, settings)
+            except ValueError as e:
+                stdout.write('%s\n' % e)
+                continue
+        if draw(render, changed, stdout):
+            settings = changed
+    stdout.write('\n')
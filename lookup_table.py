@@ -0,0 +1,109 @@
+'''
+Precomputed RGB to palette index lookup tables.
+
+Each channel is quantized to `bits` bits and the palette entry nearest to the centre of every
+resulting cell of the RGB cube is stored in a flat byte array, so matching a pixel is a single
+index. Tables are built once per palette and stored in the cache directory.
+
+Tolerance: a pixel is matched as if it were the centre of its cell, so it is off by at most
+2 ** (7 - bits) per channel (4 at the default of 5 bits) compared to the exact search of the
+distance metric. Colors well inside a palette entry's region match identically; only pixels
+within that distance of a boundary between two entries may pick the neighbouring entry.
+'''
+import os
+import hashlib
+import threading
+from array import array
+import color_conversions
+import distance
+import cache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_BITS = 5
+FORMAT_VERSION = 1
+
+_tables = {}
+# Held while a table is loaded or built, so concurrent renderers build each table only once
+_lock = threading.Lock()
+
+
+def build_table(rgb_values, bits=DEFAULT_BITS, metric=distance.DEFAULT_METRIC):
+    '''
+    Computes the lookup table for a palette by matching the centre of every cell with the
+    distance metric called metric
+    '''
+    nearest = distance.get_metric(metric, rgb_values)
+    shift = 8 - bits
+    levels = [min(255, (i << shift) + ((1 << shift) >> 1)) for i in range(1 << bits)]
+    if numpy is not None:
+        r, g, b = numpy.meshgrid(levels, levels, levels, indexing='ij')
+        lab = color_conversions.rgb_to_cielab_array(numpy.stack((r, g, b), axis=-1))
+        return array('B', nearest.nearest_array(lab).astype(numpy.uint8).tostring())
+    table = array('B')
+    for r in levels:
+        for g in levels:
+            for b in levels:
+                table.append(nearest.nearest(*color_conversions.rgb_to_cielab(r, g, b)))
+    return table
+
+
+def table_path(rgb_values, bits, metric):
+    key = hashlib.sha1(repr((FORMAT_VERSION, bits, list(rgb_values)))).hexdigest()
+    return os.path.join(cache.get_cache_dir(), 'lut-%s-%d-%s.bin' % (metric, bits, key))
+
+
+def get_table(rgb_values, bits=DEFAULT_BITS, metric=distance.DEFAULT_METRIC):
+    '''
+    Returns the lookup table for a palette and distance metric, loading it from disk or building
+    and storing it
+    '''
+    key = (bits, metric, tuple(rgb_values))
+    with _lock:
+        if key not in _tables:
+            _tables[key] = load_table(rgb_values, bits, metric)
+        return _tables[key]
+
+
+def load_table(rgb_values, bits, metric):
+    '''
+    Reads the stored table for a palette, building and storing it if it is missing or damaged.
+    Without a usable cache directory the table is only kept in memory.
+    '''
+    path = None
+    table = array('B')
+    try:
+        path = table_path(rgb_values, bits, metric)
+        with open(path, 'rb') as fs:
+            table.fromstring(fs.read())
+    except (IOError, OSError):
+        pass
+    if len(table) != 1 << (3 * bits):
+        table = build_table(rgb_values, bits, metric)
+        if path is not None:
+            try:
+                cache.write_atomic(path, table.tostring())
+            except (IOError, OSError):
+                pass
+    return table
+
+
+def lookup(table, bits, r, g, b):
+    '''
+    Returns the palette index for an RGB color
+    '''
+    shift = 8 - bits
+    return table[((r >> shift) << (2 * bits)) | ((g >> shift) << bits) | (b >> shift)]
+
+
+def lookup_array(table, bits, rgb):
+    '''
+    Array version of lookup for a ... x 3 array of 8-bit RGB colors. Requires numpy.
+    '''
+    shift = 8 - bits
+    rgb = numpy.asarray(rgb, dtype=numpy.intp) >> shift
+    return numpy.frombuffer(table, dtype=numpy.uint8)[
+        (rgb[..., 0] << (2 * bits)) | (rgb[..., 1] << bits) | rgb[..., 2]]
@@ -0,0 +1,103 @@
+'''
+Memoization of exact color matches.
+
+Resized images repeat many colors, and more so when posterized, but the exact search converts
+every pixel to CIELAB and compares it against the palette. A MatchCache remembers the palette
+index found for each RGB color; arrays of colors are reduced to their distinct colors, which
+are looked up and matched together. It is bounded with two generations of entries: new entries go
+into the recent generation, and when that is full it replaces the older one, whose entries are
+dropped unless they were used meanwhile. This evicts the least recently used colors at about
+the cost of a dict lookup. One cache is kept per palette and metric and shared by all renders.
+'''
+import threading
+import color_conversions
+import distance
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_SIZE = 1 << 16
+
+_caches = {}
+_lock = threading.Lock()
+
+
+class MatchCache(object):
+    def __init__(self, metric, size=DEFAULT_SIZE):
+        '''
+        metric is the distance.Metric of the palette; at most size colors are remembered
+        '''
+        self.metric = metric
+        self.size = size
+        self.recent = {}
+        self.older = {}
+        # Counted without locking, so they can be slightly off when renders run in parallel
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, key):
+        '''
+        Returns the remembered index of a packed 0xRRGGBB color, or None
+        '''
+        index = self.recent.get(key)
+        if index is None:
+            index = self.older.get(key)
+            if index is not None:
+                self.store(key, index)
+        return index
+
+    def store(self, key, index):
+        if len(self.recent) >= self.size // 2:
+            self.older = self.recent
+            self.recent = {}
+        self.recent[key] = index
+
+    def nearest(self, r, g, b):
+        '''
+        Returns the index of the palette entry nearest to an RGB color
+        '''
+        key = (r << 16) | (g << 8) | b
+        index = self.find(key)
+        if index is None:
+            self.misses += 1
+            index = self.metric.nearest(*color_conversions.rgb_to_cielab(r, g, b))
+            self.store(key, index)
+        else:
+            self.hits += 1
+        return index
+
+    def nearest_array(self, rgb):
+        '''
+        Array version of nearest for a ... x 3 array of 8-bit RGB colors. Requires numpy.
+        Every distinct color in the array is looked up once, and the colors not remembered are
+        matched together and stored. Each of them counts as one miss and every other pixel as a hit.
+        '''
+        rgb = numpy.asarray(rgb, dtype=numpy.int32)
+        keys, inverse = numpy.unique((rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2], return_inverse=True)
+        found = [self.find(key) for key in keys.tolist()]
+        unknown = numpy.array([index is None for index in found], dtype=bool)
+        indices = numpy.array([-1 if index is None else index for index in found], dtype=numpy.intp)
+        if unknown.any():
+            new_keys = keys[unknown]
+            colors = numpy.stack((new_keys >> 16, (new_keys >> 8) & 0xff, new_keys & 0xff), axis=-1)
+            new_indices = self.metric.nearest_array(color_conversions.rgb_to_cielab_array(colors))
+            indices[unknown] = new_indices
+            for key, index in zip(new_keys.tolist(), new_indices.tolist()):
+                self.store(key, index)
+        misses = int(unknown.sum())
+        self.misses += misses
+        self.hits += inverse.size - misses
+        return indices[inverse].reshape(rgb.shape[:-1])
+
+
+def get_cache(metric, rgb_values, size=DEFAULT_SIZE):
+    '''
+    Returns the shared cache of the metric called metric for a palette
+    '''
+    key = (metric, size, tuple(rgb_values))
+    with _lock:
+        if key not in _caches:
+            _caches[key] = MatchCache(distance.get_metric(metric, rgb_values), size)
+        return _caches[key]
@@ -0,0 +1,92 @@
+'''
+Per-render metrics.
+
+A Recorder collects the time spent in each stage of one render along with its sizes, and the
+finished record, a flat dict, is passed to whatever callback the renderer was given. Stages:
+
+    decode  opening and decoding the source image
+    resize  resizing it to the output size
+    match   matching pixels to palette indices
+    emit    encoding the output lines
+
+When a render is split across worker processes, match and emit are the sum of the time spent
+in them by every worker, and can add up to more than the total.
+
+Records can be written one JSON object per line with JSONLinesSink. With profiling on, each render
+is also run under cProfile, only while inside a stage, and the statistics are stored in a file
+that pstats can read.
+'''
+import os
+import sys
+import time
+import itertools
+from contextlib import contextmanager
+
+_profile_counter = itertools.count()
+
+
+class Recorder(object):
+    def __init__(self, profile_dir=None):
+        '''
+        With profile_dir the stages are profiled and the statistics saved in that directory
+        '''
+        self.record = {}
+        self.start = time.time()
+        self.profile_dir = profile_dir
+        self.profiler = None
+        if profile_dir:
+            import cProfile
+            self.profiler = cProfile.Profile()
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Adds the time spent in the block to the named stage
+        '''
+        if self.profiler:
+            self.profiler.enable()
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record[name] = self.record.get(name, 0.0) + time.time() - start
+            if self.profiler:
+                self.profiler.disable()
+
+    def add(self, values):
+        '''
+        Adds the stage times and counts of part of the render done elsewhere, such as in a worker
+        process, to the record
+        '''
+        for name, value in values.items():
+            self.record[name] = self.record.get(name, 0) + value
+
+    def finish(self, **values):
+        '''
+        Returns the record with values and the total time since the recorder was created added
+        '''
+        self.record.update(values)
+        self.record['total'] = time.time() - self.start
+        if self.profiler:
+            path = os.path.join(self.profile_dir, 'render-%d-%d.prof' % (os.getpid(), next(_profile_counter)))
+            self.profiler.dump_stats(path)
+            self.record['profile'] = path
+        return self.record
+
+
+class JSONLinesSink(object):
+    def __init__(self, path):
+        '''
+        Writes every record as a line of JSON to the file at path, or to stderr if path is '-'.
+        The file is opened for appending on every record, so forked workers can share it.
+        '''
+        self.path = path
+
+    def __call__(self, record):
+        import json
+        line = json.dumps(record, sort_keys=True) + '\n'
+        if self.path == '-':
+            sys.stderr.write(line)
+        else:
+            with open(self.path, 'a') as fs:
+                fs.write(line)
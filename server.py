@@ -0,0 +1,100 @@
+'''
+Long-running render server, so clients like the IRC bot skip the interpreter and PIL start-up
+and the palette set-up on every image.
+
+Requests are plain HTTP, served on a TCP host:port or on a Unix socket. They carry the usual
+command-line arguments, either as repeated `arg` query parameters:
+
+    curl --unix-socket /tmp/termimage.sock 'http://localhost/?arg=-i&arg=--hires&arg=http://...'
+
+or as a JSON list in the body of a POST. Every request is handled in its own forked child, so
+slow downloads do not block other clients and each request can use its own options.
+'''
+import os
+import sys
+import stat
+import json
+import urlparse
+import SocketServer
+import BaseHTTPServer
+
+
+class RenderHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = urlparse.urlsplit(self.path).query
+        self.respond(urlparse.parse_qs(query).get('arg', []))
+
+    def do_POST(self):
+        try:
+            argv = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            argv = None
+        if not isinstance(argv, list) or not all(isinstance(arg, basestring) for arg in argv):
+            self.send_error(400, 'The body must be a JSON list of arguments')
+            return
+        self.respond([arg.encode('utf8') if isinstance(arg, unicode) else arg for arg in argv])
+
+    def respond(self, argv):
+        status, body = self.server.render(argv)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # The base class does a reverse DNS lookup for every request
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        sys.stderr.write('%s - - [%s] %s\n' % (self.address_string(), self.log_date_time_string(), format % args))
+
+
+class TCPRenderServer(SocketServer.ForkingMixIn, BaseHTTPServer.HTTPServer):
+    def __init__(self, address, render):
+        self.render = render
+        BaseHTTPServer.HTTPServer.__init__(self, address, RenderHandler)
+
+
+class UnixRenderServer(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    def __init__(self, path, render):
+        self.render = render
+        remove_socket(path)
+        SocketServer.UnixStreamServer.__init__(self, path, RenderHandler)
+
+
+def remove_socket(path):
+    '''
+    Removes a Unix socket left at path by an earlier server. Anything else there is kept, and
+    binding to the path then fails.
+    '''
+    try:
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def serve(address, render):
+    '''
+    Serves render requests on address, which is host:port, a port on localhost or a Unix socket
+    path, until interrupted. render is called in the child handling a request with its list of
+    arguments and returns (HTTP status, body).
+    '''
+    if address.isdigit():
+        address = 'localhost:' + address
+    if '/' in address or ':' not in address:
+        server = UnixRenderServer(address, render)
+    else:
+        host, port = address.rsplit(':', 1)
+        server = TCPRenderServer((host, int(port)), render)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if isinstance(server, UnixRenderServer):
+            remove_socket(address)
@@ -1,13 +1,30 @@
 #!/usr/bin/python
-import rgb_values
+import rgb_values as palettes
 import color_conversions
-import Image, ImageOps, ImageEnhance
-import urllib2
+import lookup_table
+import distance
+import match_cache
+import cache
+import encoder
+import export
+import grid
+import dither
+import metrics
+import Image, ImageEnhance
 from cStringIO import StringIO
-from math import sqrt
-from optparse import OptionParser
-import json
+from optparse import OptionParser, OptionValueError
+import copy
+import itertools
+import collections
+import mmap
+import os
 import sys
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 parser = OptionParser(description='''Takes an image URL and outputs it in the terminal using ANSI terminal colors. Also contains
                                     options for xterm colors and IRC output.''')
@@ -16,15 +33,29 @@ parser.add_option('--hires', action='store_true', dest='high_res',
 parser.add_option('-c', '--contrast', action='store', dest='contrast',
                   type=float, metavar='VALUE', help='Set the contrast level. Default is 1.0.')
 parser.add_option('-b', '--black', action='store', dest='black_threshold',
-                  type=float, default=0.0, metavar='VALUE', help='Set the black threshold. Default is 0.0.')
+                  type=float, default=0.0, metavar='VALUE',
+                  help='Draw pixels with a CIELAB lightness of at most VALUE (0-100) as black. Default is 0.0.')
 parser.add_option('-w', '--white', action='store', dest='white_threshold',
-                  type=float, default=0.0, metavar='VALUE', help='Set the white threshold. Default is 0.0.')
+                  type=float, default=0.0, metavar='VALUE',
+                  help='Draw pixels whose lightness is within VALUE of white (100) as white. Default is 0.0.')
 parser.add_option('-s', '--step', action='store', dest='step',
                   type=int, default=2, metavar='STEP')
 parser.add_option('-i', '--irc', action='store_true', dest='irc',
                   default=False, help='Output image using IRC color codes.')
 parser.add_option('-x', '--xterm', action='store_true', dest='xterm',
                   default=False, help='Uses xterm 256 colors.')
+parser.add_option('-t', '--truecolor', action='store_true', dest='truecolor',
+                  default=False, help='Uses 24-bit colors, written straight from the image without color matching.')
+parser.add_option('--truecolor-bits', action='store', dest='truecolor_bits', type=int, default=8, metavar='BITS',
+                  help='Bits kept per channel in truecolor mode. Fewer bits repeat more colors and shorten the output. Default is 8.')
+parser.add_option('-f', '--format', action='store', dest='format', type='choice', default='text', metavar='FORMAT',
+                  choices=['text', 'html', 'png', 'grid'],
+                  help='Output terminal text, HTML with a CSS class per palette color, a PNG of the cells, or a binary '
+                       'cell grid that grid.py replays as text. Default is text.')
+parser.add_option('--compress', action='store_true', dest='compress', default=False,
+                  help='Compress grid output with zlib.')
+parser.add_option('--png-cell-width', action='store', dest='png_cell_width', type=int, default=8, metavar='PIXELS',
+                  help='Width of a cell in PNG output; its height follows --cell-aspect. Default is 8.')
 parser.add_option('-l', '--local', action='store', dest='filename',
                   help='Path to local file.')
 parser.add_option('--height', action='store', dest='height',
@@ -33,6 +64,10 @@ parser.add_option('--height', action='store', dest='height',
 parser.add_option('--width', action='store', dest='width',
                   type=float, default=100.0, metavar='VALUE', help='''Desired width of the output. Aspect ratio
                                                                     is always preserved. Default is 100.''')
+parser.add_option('--cell-aspect', action='store', dest='cell_aspect', type=float, default=2.0, metavar='RATIO',
+                  help='Height of a terminal cell divided by its width. Default is 2.0.')
+parser.add_option('-a', '--auto', action='store_true', dest='auto', default=False,
+                  help='Fit the image to the terminal and use the best colors it supports.')
 parser.add_option('-m', '--mode', action='store', dest='mode', type='choice', default='antialias', metavar='MODE',
                   choices=['antialias', 'nearest', 'bicubic', 'bilinear'],
                   help='Sets the resize mode. Default is antialias.')
@@ -40,224 +75,925 @@ parser.add_option('-g', '--google', action='store', dest='google', metavar='QUER
                   help='Search Google for an image matching the search query.')
 parser.add_option('-d', '--dither', action='store_true', dest='dither', default=False,
                   help='Enable dithering. Default is off.')
+parser.add_option('--dither-mode', action='store', dest='dither_mode', type='choice', default='diffusion',
+                  metavar='MODE', choices=['diffusion', 'ordered'],
+                  help='Floyd-Steinberg error diffusion or ordered Bayer dithering. Default is diffusion.')
 parser.add_option('--bw', action='store_true', dest='black_and_white', default=False,
                   help='Enable black and white')
+parser.add_option('--batch', action='store_true', dest='batch', default=False,
+                  help='Render every path or URL given as an argument, or read one per line from stdin.')
+parser.add_option('-j', '--jobs', action='store', dest='jobs', type=int, default=None, metavar='N',
+                  help='Number of worker processes in batch mode. Default is the number of CPUs.')
+parser.add_option('--workers', action='store', dest='workers', type=int, default=1, metavar='N',
+                  help='Render large images in N processes, each matching and encoding its own bands of lines. 0 uses every CPU. Default is 1.')
+parser.add_option('-o', '--output-dir', action='store', dest='output_dir', metavar='DIR',
+                  help='Write each batch result to its own file in DIR instead of a framed stream on stdout.')
+parser.add_option('--animate', action='store_true', dest='animate', default=False,
+                  help='Play all frames of an animated image, redrawing only the cells that change.')
+parser.add_option('--interactive', action='store_true', dest='interactive', default=False,
+                  help='Keep the resized image in memory and redraw it as contrast and thresholds are typed in.')
+parser.add_option('--loop', action='store_true', dest='loop', default=False,
+                  help='Repeat the animation until interrupted.')
+parser.add_option('--serve', action='store', dest='serve', metavar='ADDRESS',
+                  help='Run a render server on host:port, a port on localhost or a Unix socket path. See server.py.')
+parser.add_option('--repeat', action='store_true', dest='repeat', default=False,
+                  help='Shorten runs of the same character with the REP sequence. Not every terminal supports it.')
+parser.add_option('--stats', action='store_true', dest='stats', default=False,
+                  help='Print the number of bytes per output row to stderr.')
+parser.add_option('--cache-size', action='store', dest='cache_size', type=float, default=64.0, metavar='MB',
+                  help='Size limit of the rendered output cache in megabytes. 0 disables it. Default is 64.')
+parser.add_option('--timeout', action='store', dest='timeout', type=float, default=10.0,
+                  metavar='SECONDS', help='Timeout for network operations. Default is 10.')
+parser.add_option('--max-size', action='store', dest='max_size', type=float, default=20.0, metavar='MB',
+                  help='Largest image that will be downloaded, in megabytes. Default is 20.')
+parser.add_option('--matcher', action='store', dest='matcher', type='choice', default='lut', metavar='MATCHER',
+                  choices=['lut', 'lab', 'pil'],
+                  help="Color matching: lookup table, exact CIE delta E search or PIL's quantizer. Default is lut.")
+parser.add_option('--distance', action='store', dest='distance', type='choice', default=distance.DEFAULT_METRIC,
+                  metavar='METRIC', choices=sorted(distance.METRICS),
+                  help='Color distance used to match the palette: cie76, cie94 or ciede2000. Default is cie94.')
+parser.add_option('--metrics', action='store', dest='metrics', metavar='FILE',
+                  help="Append the timings and sizes of every render to FILE as JSON lines; '-' is stderr.")
+parser.add_option('--profile', action='store', dest='profile', metavar='DIR',
+                  help='Run every render under cProfile and store the statistics in DIR.')
+parser.add_option('--match-cache', action='store', dest='match_cache', type=int, default=match_cache.DEFAULT_SIZE,
+                  metavar='COLORS', help='Colors remembered by the exact matcher. 0 disables it. Default is 65536.')
+parser.add_option('--posterize', action='store', dest='posterize', type=int, metavar='BITS',
+                  help='Keep only BITS bits of every channel before matching, so more pixels share a color.')
+parser.add_option('--lut-bits', action='store', dest='lut_bits', type=int, default=lookup_table.DEFAULT_BITS,
+                  metavar='BITS', help='Bits per channel of the color lookup table. 0 searches the palette for every pixel. Default is 5.')
+
+# Number of output lines whose colors are matched together while streaming
+BAND_ROWS = 8
+# Options a server request may set: the ones that only change the rendered output, and the query
+REQUEST_OPTIONS = frozenset([
+    'high_res', 'contrast', 'black_threshold', 'white_threshold', 'step', 'irc', 'xterm', 'truecolor',
+    'truecolor_bits', 'format', 'png_cell_width', 'compress', 'height', 'width', 'cell_aspect', 'mode',
+    'google', 'dither', 'dither_mode', 'black_and_white', 'repeat', 'matcher', 'distance', 'posterize',
+    'lut_bits'])
+# Options requests take from the server, whatever the request says: what it caches, downloads and
+# records is up to whoever runs it
+SERVER_OPTIONS = ('cache_size', 'timeout', 'max_size', 'match_cache', 'metrics', 'profile')
+# Smallest number of output cells rendered across --workers; forking costs more for smaller images
+PARALLEL_MIN_CELLS = 1 << 15
+# Number of bands handed to each worker, so a slow band does not leave the others idle
+BANDS_PER_WORKER = 4
+# The renderer and pixels of the image being rendered across --workers, set while they are forked
+_band_source = None
+_band_lock = threading.Lock()
+# Number of animation frames prepared ahead of the one on screen
+FRAMES_AHEAD = 8
+# Images are box-reduced to no less than this many times the output size before resampling
+REDUCING_GAP = 3
 
-(options, args) = parser.parse_args()
-
-if options.irc:
-    rgb_values = rgb_values.irc_rgb_values
-elif options.high_res and not options.xterm:
-    rgb_values = rgb_values.default_rgb_values[:8]
-elif options.xterm:
-    if options.black_and_white:
-        rgb_values = rgb_values.bw_xterm_rgb_values
-    else:
-        rgb_values = rgb_values.default_rgb_values + rgb_values.xterm_rgb_values
-else:
-    rgb_values = rgb_values.default_rgb_values
-
-lab_values = [color_conversions.rgb_to_cielab(r, g, b) for (r, g, b) in rgb_values]
-
-index_to_ansi_front = [
-    '30',
-    '31',
-    '32',
-    '33',
-    '34',
-    '35',
-    '36',
-    '37',
-    '30;1',
-    '31;1',
-    '32;1',
-    '33;1',
-    '34;1',
-    '35;1',
-    '36;1',
-    '37;1'
-]
-
-index_to_ansi_back = [
-    '40',
-    '41',
-    '42',
-    '43',
-    '44',
-    '45',
-    '46',
-    '47',
-    '40;1',
-    '41;1',
-    '42;1',
-    '43;1',
-    '44;1',
-    '45;1',
-    '46;1',
-    '47;1'
-]
-
-def get_image():
-    '''
-    Retrieves the image file from the given input method; local file, google search or url
-    '''
-    if options.filename:
+
+def convert_setting(name, value):
+    '''
+    Returns a setting converted to the type of the option with the destination name, as parsing
+    the command line would, so that width=60 is the float 60.0. Raises ValueError for values the
+    option does not take.
+    '''
+    for option in parser.option_list:
+        if option.dest != name or option.type is None or value is None:
+            continue
         try:
-            fs = open(options.filename)
-        except IOError as e:
-            sys.exit(e)
-    else:
-        if options.google:
-            url = google()
+            if isinstance(value, basestring):
+                return option.check_value(option.get_opt_string(), value)
+            if option.type in ('int', 'float'):
+                return {'int': int, 'float': float}[option.type](value)
+        except (TypeError, OptionValueError) as e:
+            raise ValueError('Invalid setting %s: %s' % (name, e))
+    return value
+
+
+class Renderer(object):
+    def __init__(self, options=None, on_render=None, **settings):
+        '''
+        Holds everything a render needs: the options, the palette they select and its lookup
+        table or distance metric. options are parsed command-line options as returned by
+        parser.parse_args; settings override single options by their destination name, as in
+        Renderer(xterm=True, high_res=True). Missing options take their command-line defaults.
+        A renderer is not changed by rendering, so one can serve concurrent renders on many
+        threads. Raises ValueError for invalid settings.
+
+        on_render is called with a dict of metrics after every render; see metrics.py. It gets
+        the seconds spent in each stage and in total, cache_hit, the source_pixels and pixels
+        before and after resizing, palette_size, lines and output_bytes, and with the match cache
+        match_cache_hits and match_cache_misses.
+        '''
+        defaults = parser.get_default_values()
+        options = copy.copy(options or defaults)
+        for name, value in settings.items():
+            if not hasattr(defaults, name):
+                raise ValueError('Unknown setting: %s' % name)
+            setattr(options, name, convert_setting(name, value))
+        if not 0 <= options.lut_bits <= 8:
+            raise ValueError('--lut-bits must be between 0 and 8')
+        if not 1 <= options.truecolor_bits <= 8:
+            raise ValueError('--truecolor-bits must be between 1 and 8')
+        if options.truecolor and options.irc:
+            raise ValueError('--truecolor can not be combined with --irc')
+        if options.posterize is not None and not 1 <= options.posterize <= 8:
+            raise ValueError('--posterize must be between 1 and 8')
+        if options.workers < 0:
+            raise ValueError('--workers can not be negative')
+        if options.png_cell_width < 1:
+            raise ValueError('--png-cell-width must be at least 1')
+        if not 0 <= options.black_threshold <= 100 or not 0 <= options.white_threshold <= 100:
+            raise ValueError('--black and --white must be between 0 and 100')
+        if options.contrast is not None and options.contrast < 0:
+            raise ValueError('--contrast can not be negative')
+        if options.cell_aspect <= 0:
+            raise ValueError('--cell-aspect must be positive')
+        if options.matcher == 'lut' and not options.lut_bits:
+            options.matcher = 'lab'
+        if options.matcher == 'pil' and options.dither and options.dither_mode == 'ordered':
+            raise ValueError('--matcher=pil only supports diffusion dithering')
+        self.options = options
+        self.on_render = on_render
+        self.rgb_values = self.get_palette()
+        # Only the matcher in use needs its table; the others are left as None
+        self.metric = None
+        self.lookup = None
+        self.match_cache = None
+        if not options.truecolor:
+            if options.matcher == 'lut':
+                self.lookup = lookup_table.get_table(self.rgb_values, options.lut_bits, options.distance)
+            elif options.matcher == 'lab':
+                self.metric = distance.get_metric(options.distance, self.rgb_values)
+                if options.match_cache > 0:
+                    self.match_cache = match_cache.get_cache(options.distance, self.rgb_values, options.match_cache)
+
+    def get_palette(self):
+        '''
+        Returns the RGB values of the palette selected by the options
+        '''
+        if self.options.irc:
+            return palettes.irc_rgb_values
+        elif self.options.high_res and not self.options.xterm:
+            return palettes.default_rgb_values[:8]
+        elif self.options.xterm:
+            if self.options.black_and_white:
+                return palettes.bw_xterm_rgb_values
+            else:
+                return palettes.default_rgb_values + palettes.xterm_rgb_values
         else:
-            url = args[0]
-        headers = {'User-Agent': 'pjaeBot'}
-        request = urllib2.Request(url, None, headers)
-        fs = StringIO(urllib2.urlopen(request).read())
-    return Image.open(fs)
-
-
-def get_mode():
-    if options.mode.lower() == 'antialias':
-        return Image.ANTIALIAS
-    elif options.mode.lower() == 'bicubic':
-        return Image.BICUBIC
-    elif options.mode.lower() == 'bilinear':
-        return Image.BILINEAR
-    else:
-        return Image.NEAREST
-
-
-def quantize(im):
-    pal_im = im.convert('P')
-    vals = []
-    for val in rgb_values:
-        for n in val:
-            vals.append(n)
-    pal_im.putpalette(vals)
-    #    im = im.convert('RGB')
-    im = im.quantize(palette=pal_im)
-    im = im.convert('RGB')
-    return im
+            return palettes.default_rgb_values
 
+    def get_render_settings(self):
+        '''
+        Returns the normalized options that affect the rendered output, for use in cache keys
+        '''
+        options = self.options
+        return [('width', options.width), ('height', options.height), ('cell_aspect', options.cell_aspect),
+                ('mode', options.mode.lower()), ('high_res', options.high_res), ('irc', options.irc),
+                ('xterm', options.xterm), ('black_and_white', options.black_and_white),
+                ('contrast', options.contrast or None), ('black_threshold', options.black_threshold),
+                ('white_threshold', options.white_threshold), ('dither', options.dither and options.dither_mode),
+                ('step', options.step), ('matcher', options.matcher), ('distance', options.distance),
+                ('lut_bits', options.lut_bits), ('truecolor', options.truecolor and options.truecolor_bits),
+                ('posterize', options.posterize), ('format', options.format),
+                ('png_cell_width', options.format == 'png' and options.png_cell_width),
+                ('compress', options.format == 'grid' and options.compress),
+                ('repeat', options.repeat)]
 
-def process_image():
-    im = get_image()
-    im = im.convert('RGB')
-    #    im = quantize(im)
-    width = im.size[0]
-    height = im.size[1]
-    ratio = get_ratio(width, height)
-    resize_width = int(width * ratio + 0.5)
-    resize_height = int(height * ratio + 0.5)
-    mode = get_mode()
-    im = im.resize((resize_width, resize_height), mode)
-    if options.dither:
-        pim = im.convert('P')
-        im = pim.convert('RGB')
-    if options.contrast:
-        im = ImageEnhance.Contrast(im).enhance(options.contrast)
-    template = get_template()
-    prev_fore = prev_back = fore = back = None
-    for y in range(0, resize_height, options.step):
-        line = ''
-        for x in range(resize_width):
-            if options.high_res:
-                fore, back = (get_nearest_rgb(im, x, y), get_nearest_rgb(im, x, y + 1, back=True))
-                if prev_fore == fore and prev_back == back and x != 0:
-                    line += u'\u2580'
-                elif prev_fore == fore and x != 0:
-                    line += template['back'].format(fore, back) + u'\u2580'
-                elif prev_back == back and x != 0:
-                    line += template['fore'].format(fore, back) + u'\u2580'
-                else:
-                    line += template['both'].format(fore, back) + u'\u2580'
+    def get_mode(self):
+        if self.options.mode.lower() == 'antialias':
+            return Image.ANTIALIAS
+        elif self.options.mode.lower() == 'bicubic':
+            return Image.BICUBIC
+        elif self.options.mode.lower() == 'bilinear':
+            return Image.BILINEAR
+        else:
+            return Image.NEAREST
+
+    def quantize(self, im):
+        '''
+        Maps every pixel of an RGB image to the palette in one call to PIL's quantizer, which picks
+        the nearest entry by RGB distance. Returns a 'P' image whose pixel values are palette indices.
+        '''
+        pal_im = Image.new('P', (1, 1))
+        vals = []
+        # The palette is padded to 256 entries with copies of the first one, which never win a tie
+        for val in self.rgb_values + [self.rgb_values[0]] * (256 - len(self.rgb_values)):
+            for n in val:
+                vals.append(n)
+        pal_im.putpalette(vals)
+        im.load()
+        if self.options.dither:
+            dither_mode = Image.FLOYDSTEINBERG
+        else:
+            dither_mode = Image.NONE
+        return im._new(im.im.convert('P', dither_mode, pal_im.im))
+
+    def render(self, image):
+        '''
+        Returns the complete output for an image, given as its raw bytes or as an opened PIL image.
+        The bytes can be a string or any buffer, such as an mmap. Raw bytes go through the render
+        cache unless the cache_size setting is 0.
+        '''
+        if not isinstance(image, Image.Image):
+            return ''.join(self.iter_output(image))
+        return ''.join(self.iter_rows(image))
+
+    def iter_rows(self, image, recorder=None):
+        '''
+        Yields the output lines of an image, given as its raw bytes or as an opened PIL image, as
+        UTF-8 bytes ending in a newline, each one as soon as it is computed. HTML output also has
+        a header and a footer, and PNG and grid output are yielded in one piece.
+        '''
+        recorder = recorder or metrics.Recorder(self.options.profile)
+        if self.match_cache is not None:
+            hits, misses = self.match_cache.hits, self.match_cache.misses
+        with recorder.stage('decode'):
+            if not isinstance(image, Image.Image):
+                image = Image.open(StringIO(image))
+            source_width, source_height = image.size
+            size = self.get_output_size(image.size)
+            im = self.decode_image(image, size)
+        with recorder.stage('resize'):
+            im = self.resize_image(im, size)
+        output_bytes = 0
+        for chunk in self.iter_formatted(im, recorder):
+            output_bytes += len(chunk)
+            yield chunk
+        if self.match_cache is not None:
+            recorder.add({'match_cache_hits': self.match_cache.hits - hits,
+                          'match_cache_misses': self.match_cache.misses - misses})
+        self.report(recorder.finish(cache_hit=False, source_pixels=source_width * source_height,
+                                    pixels=size[0] * size[1], lines=self.get_line_count(size[1]),
+                                    output_bytes=output_bytes))
+
+    def iter_formatted(self, im, recorder):
+        '''
+        Yields the output of a resized image in the format of the options
+        '''
+        rgb_values = self.rgb_values if not self.options.truecolor else None
+        if self.options.format in ('png', 'grid'):
+            workers = self.get_workers(im.size)
+            if workers > 1:
+                rows = list(self.iter_parallel_bands(im, workers, recorder, encode=False))
             else:
-                back = get_nearest_rgb(im, x, y, back=True)
-                if prev_back == back and x != 0:
-                    line += u' '
+                with recorder.stage('match'):
+                    rows = list(self.iter_index_rows(im))
+            with recorder.stage('emit'):
+                if self.options.format == 'grid':
+                    output = grid.dumps(grid.Grid(grid.find_palette(rgb_values), rows), self.options.compress)
                 else:
-                    line += template.format(back) + u' '
-            prev_fore, prev_back = fore, back
-        if not options.irc:
-            line += '\033[0m'
-        print line.encode('utf8')
+                    cell_width = self.options.png_cell_width
+                    output = export.render_png(rows, rgb_values, cell_width,
+                                               max(1, int(cell_width * self.options.cell_aspect + 0.5)))
+            yield output
+            return
+        if self.options.format == 'html':
+            yield export.get_html_header(rgb_values, self.options.high_res)
+        for line in self.iter_lines(im, recorder):
+            yield line
+        if self.options.format == 'html':
+            yield export.HTML_FOOTER
 
+    def iter_lines(self, im, recorder):
+        '''
+        Yields the encoded output lines of a resized image, split across worker processes if
+        get_workers says so
+        '''
+        workers = self.get_workers(im.size)
+        if workers > 1:
+            for line in self.iter_parallel_bands(im, workers, recorder):
+                yield line
+            return
+        line_encoder = self.get_encoder()
+        index_rows = self.iter_index_rows(im)
+        while True:
+            with recorder.stage('match'):
+                try:
+                    top_row, bottom_row = next(index_rows)
+                except StopIteration:
+                    break
+            with recorder.stage('emit'):
+                line = line_encoder.encode_line(top_row, bottom_row).encode('utf8') + '\n'
+            yield line
 
-def get_ratio(width, height):
-    max_width = options.width
-    max_height = options.height
-    return min(max_width / width, max_height / height)
+    def get_workers(self, size):
+        '''
+        Returns the number of processes a resized image is rendered in. Error diffusion carries
+        its error from each line into the next, so it always runs in one, and so do images of
+        fewer than PARALLEL_MIN_CELLS cells and renders inside batch workers, which can not fork.
+        '''
+        if self.options.workers == 1 or self.uses_diffusion():
+            return 1
+        if size[0] * self.get_line_count(size[1]) < PARALLEL_MIN_CELLS:
+            return 1
+        import multiprocessing
+        if multiprocessing.current_process().daemon:
+            return 1
+        return self.options.workers or multiprocessing.cpu_count()
 
+    def iter_parallel_bands(self, im, workers, recorder, encode=True):
+        '''
+        Yields the output lines of a resized image rendered by a pool of worker processes, or
+        without encode its (top, bottom) index row pairs. The pixels are read first and the
+        workers forked afterwards, so they share them instead of being sent a copy. The lines are
+        cut into bands that the workers match and encode, and the bands are yielded in order as
+        they come back. Every line starts with no colors set, so a band comes out the same as it
+        does in one process.
+        '''
+        global _band_source
+        import multiprocessing
+        with recorder.stage('match'):
+            pixels = self.get_pixels(im)
+        count = self.get_line_count(im.size[1])
+        size = max(BAND_ROWS, -(-count // (workers * BANDS_PER_WORKER)))
+        bands = [(start, min(start + size, count), encode) for start in range(0, count, size)]
+        with _band_lock:
+            _band_source = self, pixels
+            try:
+                pool = multiprocessing.Pool(min(workers, len(bands)))
+            finally:
+                _band_source = None
+        try:
+            for results, record in pool.imap(render_band, bands):
+                recorder.add(record)
+                for result in results:
+                    yield result
+        finally:
+            pool.terminate()
+            pool.join()
 
-def get_template():
-    '''
-    Get the string template based on the options
-    '''
-    if options.irc:
-        if options.high_res:
-            return {'both': '\x03{0},{1}', 'fore': '\x03{0}', 'back': '\x03,{1}'}
+    def report(self, record):
+        '''
+        Passes the metrics of a finished render to the on_render callback
+        '''
+        if self.on_render is not None:
+            record['palette_size'] = (1 << 3 * self.options.truecolor_bits if self.options.truecolor
+                                      else len(self.rgb_values))
+            self.on_render(record)
+
+    def iter_output(self, data):
+        '''
+        Yields the encoded output for the raw image bytes. A cached render is yielded in one piece
+        without decoding the image; otherwise lines are yielded as they are computed and the
+        complete output is stored in the cache afterwards.
+        '''
+        recorder = metrics.Recorder(self.options.profile)
+        if self.options.cache_size:
+            key = cache.render_key(data, self.get_render_settings())
+            output = cache.get_render(key)
+            if output is not None:
+                yield output
+                if self.options.format == 'text':
+                    recorder.record['lines'] = output.count('\n')
+                self.report(recorder.finish(cache_hit=True, output_bytes=len(output)))
+                return
+        lines = []
+        for line in self.iter_rows(data, recorder):
+            lines.append(line)
+            yield line
+        if self.options.cache_size:
+            cache.put_render(key, ''.join(lines), int(self.options.cache_size * 1024 * 1024))
+
+    def get_output_size(self, size):
+        '''
+        Returns the size the image is resized to. Every cell is two pixel rows tall, so the image
+        is squeezed vertically when cells are less than twice as tall as they are wide.
+        '''
+        width, height = size
+        height = height * 2. / self.options.cell_aspect
+        ratio = self.get_ratio(width, height)
+        return int(width * ratio + 0.5), int(height * ratio + 0.5)
+
+    def decode_image(self, im, size):
+        '''
+        Decodes an opened image to RGB. JPEGs are decoded at the smallest reduced scale that is still
+        at least size, so pixels that would be resized away are never decoded. Whatever is still
+        more than REDUCING_GAP times too large is then reduced by a whole factor, averaging blocks
+        of pixels, which is much cheaper than resampling the full image with the resize filter.
+        '''
+        im.draft('RGB', size)
+        im.load()
+        if im.mode != 'RGB':
+            im = im.convert('RGB')
+        width, height = im.size
+        factor = min(width // (max(size[0], 1) * REDUCING_GAP), height // (max(size[1], 1) * REDUCING_GAP))
+        if factor > 1 and hasattr(Image, 'BOX'):
+            im = im.resize((width // factor, height // factor), Image.BOX)
+        return im
+
+    def resize_image(self, im, size):
+        #    im = quantize(im)
+        mode = self.get_mode()
+        return self.adjust_image(im.resize(size, mode))
+
+    def adjust_image(self, im):
+        '''
+        Applies the contrast, thresholds and posterizing of the options to a resized image. The
+        image passed in is left as it is.
+        '''
+        if self.options.contrast:
+            im = ImageEnhance.Contrast(im).enhance(self.options.contrast)
+        if self.options.black_threshold or self.options.white_threshold:
+            im = self.apply_thresholds(im)
+        if self.options.posterize:
+            # Values are moved to the middle of the range that shares their remaining bits
+            shift = 8 - self.options.posterize
+            im = im.point([(value >> shift << shift) | ((1 << shift) >> 1) for value in range(256)] * 3)
+        return im
+
+    def apply_thresholds(self, im):
+        '''
+        Returns a copy of the image with pixels at most --black in CIELAB lightness made black and
+        those within --white of full lightness made white. Lightness only depends on luminance,
+        so the luminance of the pixels is compared against that of the thresholds.
+        '''
+        linear = color_conversions.LINEAR
+        black = color_conversions.lightness_to_luminance(self.options.black_threshold)
+        white = color_conversions.lightness_to_luminance(100 - self.options.white_threshold)
+        if numpy is not None:
+            pixels = numpy.array(im, dtype=numpy.uint8)
+            linear = numpy.array(linear)
+            Y = linear[pixels[..., 0]] * 0.2126 + linear[pixels[..., 1]] * 0.7152 + linear[pixels[..., 2]] * 0.0722
+            if self.options.black_threshold:
+                pixels[Y <= black] = 0
+            if self.options.white_threshold:
+                pixels[Y >= white] = 255
+            return Image.fromarray(pixels, 'RGB')
+        replaced = {}
+        for color in set(im.getdata()):
+            r, g, b = color
+            Y = linear[r] * 0.2126 + linear[g] * 0.7152 + linear[b] * 0.0722
+            if self.options.white_threshold and Y >= white:
+                replaced[color] = (255, 255, 255)
+            elif self.options.black_threshold and Y <= black:
+                replaced[color] = (0, 0, 0)
+        im = im.copy()
+        if replaced:
+            im.putdata([replaced.get(color, color) for color in im.getdata()])
+        return im
+
+    def iter_index_rows(self, im):
+        '''
+        Yields a (top, bottom) pair of palette index rows for every output line of a resized image.
+        bottom is None outside hires mode. Colors are matched BAND_ROWS lines at a time. In truecolor
+        mode the rows hold packed RGB values instead of palette indices.
+        '''
+        pixels = self.get_pixels(im)
+        diffusion = None
+        if self.uses_diffusion():
+            diffusion = dither.ErrorDiffusion(self.rgb_values, self.get_nearest_index)
+        count = self.get_line_count(im.size[1])
+        for start in range(0, count, BAND_ROWS):
+            for rows in self.get_band(pixels, start, min(start + BAND_ROWS, count), diffusion):
+                yield rows
+
+    def uses_diffusion(self):
+        '''
+        Returns whether pixels are matched through dither.ErrorDiffusion
+        '''
+        options = self.options
+        return options.dither and options.dither_mode == 'diffusion' and options.matcher != 'pil' and not options.truecolor
+
+    def get_line_count(self, height):
+        '''
+        Returns the number of output lines of a resized image height pixels tall
+        '''
+        return -(-height // self.options.step)
+
+    def get_band(self, pixels, start, end, diffusion=None):
+        '''
+        Returns the (top, bottom) palette index row pairs of the output lines start to end
+        '''
+        ys = range(start * self.options.step, end * self.options.step, self.options.step)
+        if self.options.high_res:
+            index_rows = self.get_index_rows(pixels, [y + offset for y in ys for offset in (0, 1)], diffusion)
+            return zip(index_rows[::2], index_rows[1::2])
+        return [(row, None) for row in self.get_index_rows(pixels, ys, diffusion)]
+
+    def get_ratio(self, width, height):
+        max_width = self.options.width
+        max_height = self.options.height
+        return min(max_width / width, max_height / height)
+
+    def get_target(self):
+        '''
+        Returns the output target of the options, one of encoder.TEMPLATES
+        '''
+        if self.options.irc:
+            return 'irc'
+        elif self.options.truecolor:
+            return 'truecolor'
+        elif self.options.xterm:
+            return 'xterm-bw' if self.options.black_and_white else 'xterm'
         else:
-            return '\x03{0},{0}'
-    elif options.xterm:
-        if options.high_res:
-            return {'both': '\033[38;5;{0}m\033[48;5;{1}m', 'fore': '\033[38;5;{0}m', 'back': '\033[48;5;{1}m'}
+            return 'ansi'
+
+    def get_encoder(self):
+        if self.options.format == 'html':
+            return export.HTMLEncoder(self.options.truecolor)
+        return encoder.get_encoder(self.get_target(), self.options.repeat)
+
+    def get_pixels(self, im):
+        '''
+        Reads the resized image in one call. Returns an (H + 1) x W x 3 array with numpy, otherwise a
+        list of rows of (r, g, b) tuples. The extra last row is black, so rows below the image can be
+        read from it without bounds checks. With the PIL matcher the image is quantized first and the
+        rows hold palette indices instead.
+        '''
+        width, height = im.size
+        if self.options.matcher == 'pil' and not self.options.truecolor:
+            padded = Image.new('RGB', (width, height + 1))
+            padded.paste(im, (0, 0))
+            data = list(self.quantize(padded).getdata())
+            return [data[y * width:(y + 1) * width] for y in range(height + 1)]
+        if numpy is not None:
+            pixels = numpy.asarray(im, dtype=numpy.uint8)
+            return numpy.concatenate((pixels, numpy.zeros((1, width, 3), dtype=numpy.uint8)))
+        data = list(im.getdata())
+        rows = [data[y * width:(y + 1) * width] for y in range(height)]
+        rows.append([(0, 0, 0)] * width)
+        return rows
+
+    def get_index_rows(self, pixels, ys, diffusion=None):
+        '''
+        Returns the palette indices of the pixel rows ys. Rows below the image are black.
+        With diffusion the rows are dithered through it, and must be passed in order.
+        '''
+        last = len(pixels) - 1
+        ys = [min(y, last) for y in ys]
+        if self.options.truecolor:
+            return self.get_truecolor_rows(pixels, ys)
+        if self.options.matcher == 'pil':
+            return [pixels[y] for y in ys]
+        if diffusion is not None:
+            if numpy is None:
+                return [diffusion.dither_row(pixels[y]) for y in ys]
+            return [diffusion.dither_row(pixels[y].tolist()) for y in ys]
+        ordered = self.options.dither and self.options.dither_mode == 'ordered'
+        if numpy is None:
+            rows = [pixels[y] for y in ys]
+            if ordered:
+                spread = dither.get_spread(self.rgb_values)
+                rows = [dither.ordered_row(row, y, spread) for (row, y) in zip(rows, ys)]
+            return [[self.get_nearest_index(r, g, b) for (r, g, b) in row] for row in rows]
+        band = pixels[ys]
+        if ordered:
+            band = dither.ordered_array(band, ys, dither.get_spread(self.rgb_values))
+        if self.lookup is not None:
+            indices = lookup_table.lookup_array(self.lookup, self.options.lut_bits, band)
+        elif self.match_cache is not None:
+            indices = self.match_cache.nearest_array(band)
         else:
-            return '\033[48;5;{0}m'
-    else:
-        if options.high_res:
-            return {'both': '\033[{0};{1}m', 'fore': '\033[{0}m', 'back': '\033[{1}m'}
+            indices = self.metric.nearest_array(color_conversions.rgb_to_cielab_array(band))
+        return indices.tolist()
+
+    def get_truecolor_rows(self, pixels, ys):
+        '''
+        Returns the pixel rows ys with every pixel packed into one integer, 0xRRGGBB, so equal colors
+        compare equal in the encoder. Channels are cut to --truecolor-bits, keeping the middle of each
+        range of values that share the remaining bits.
+        '''
+        shift = 8 - self.options.truecolor_bits
+        half = (1 << shift) >> 1
+        if numpy is None:
+            return [[((r >> shift << shift | half) << 16) | ((g >> shift << shift | half) << 8) |
+                     (b >> shift << shift | half) for (r, g, b) in pixels[y]] for y in ys]
+        band = pixels[ys] >> shift << shift | half
+        band = band.astype(numpy.int32)
+        return ((band[..., 0] << 16) | (band[..., 1] << 8) | band[..., 2]).tolist()
+
+    def get_nearest_index(self, r, g, b):
+        if self.lookup is not None:
+            return lookup_table.lookup(self.lookup, self.options.lut_bits, r, g, b)
+        elif self.match_cache is not None:
+            return self.match_cache.nearest(r, g, b)
         else:
-            return '\033[{0}m'
+            return self.metric.nearest(*color_conversions.rgb_to_cielab(r, g, b))
 
 
-def get_nearest_rgb(im, x, y, back=False): #deprecated
-    nearest = None
+def configure(new_options, new_args):
+    '''
+    Sets the module-level options and the renderer used by the command line
+    '''
+    global options, args, renderer
+    on_render = None
+    if new_options.metrics:
+        on_render = metrics.JSONLinesSink(new_options.metrics)
     try:
-        r1, g1, b1 = im.getpixel((x, y))
-    except IndexError:
-        r1 = g1 = b1 = 0
-    l1, a1, b1 = color_conversions.rgb_to_cielab(r1, g1, b1)
-    for index, (l2, a2, b2) in enumerate(lab_values):
-        dL = l1 - l2
-        c1 = sqrt(a1 ** 2 + b1 ** 2)
-        c2 = sqrt(a2 ** 2 + b2 ** 2)
-        dC = c1 - c2
-        dA = a1 - a2
-        dB = b1 - b2
-        dH = dA ** 2 + dB ** 2 - dC ** 2
-        dE = sqrt((dL / 1) ** 2 + (dC / (1 + 0.045 * c1)) ** 2 + (dH / (1 + 0.015 * c2) ** 2))
-        if dE < nearest or nearest is None:
-        #            if (i == 0 or i == 15) and dE < options.black_threshold or (i == 7 or i == 15) and dE < options.white_threshold:
-        #                pass
-        #            else:
-            nearest = dE
-            color_index = index
-    if options.irc or options.xterm:
-        if options.xterm and options.black_and_white:
-            color_index += 232
-        return color_index
-    else:
-        if back:
-            return index_to_ansi_back[color_index]
+        renderer = Renderer(new_options, on_render)
+    except ValueError as e:
+        parser.error(str(e))
+    options, args = renderer.options, new_args
+
+
+def fit_terminal(new_options):
+    '''
+    Sets the colors, hires mode, cell shape and output size of --auto for the terminal on stdout.
+    Colors and hires are only picked when no color mode was given, a --cell-aspect that was given
+    is kept, and so is a --width or --height that was given if it is smaller than the terminal.
+    '''
+    import terminal
+    capabilities = terminal.get_capabilities()
+    defaults = parser.get_default_values()
+    if not (new_options.irc or new_options.xterm or new_options.truecolor):
+        if capabilities['colors'] >= 1 << 24:
+            new_options.truecolor = True
+        elif capabilities['colors'] >= 256:
+            new_options.xterm = True
+        # Hires needs block characters, and halves the colors of the 16 color palette
+        if new_options.truecolor or new_options.xterm:
+            new_options.high_res = new_options.high_res or terminal.is_unicode()
+    if new_options.cell_aspect == defaults.cell_aspect:
+        new_options.cell_aspect = capabilities['cell_aspect']
+    columns, lines = terminal.get_size()
+    # One line is left for the prompt
+    rows = (2 if new_options.high_res else new_options.step) * max(lines - 1, 1)
+    if new_options.width == defaults.width or new_options.width > columns:
+        new_options.width = float(columns)
+    if new_options.height == defaults.height or new_options.height > rows:
+        new_options.height = float(rows)
+
+
+def get_image_data():
+    '''
+    Retrieves the raw image bytes from the given input method; local file, google search or url
+    '''
+    try:
+        if options.filename:
+            return read_file(options.filename)
+        elif options.google:
+            return fetch(google())
         else:
-            return index_to_ansi_front[color_index]
+            return fetch(args[0])
+    except IOError as e:
+        sys.exit(e)
+
+
+def fetch(url):
+    '''
+    Downloads url with the network options; unchanged images are revalidated instead of downloaded
+    '''
+    import downloads
+    return downloads.fetch(url, timeout=options.timeout, max_size=int(options.max_size * 1024 * 1024),
+                           cache_size=int(options.cache_size * 1024 * 1024))
+
+
+def load_image_data(source):
+    '''
+    Reads the raw bytes of a batch source, which is either an http(s) URL or a local path
+    '''
+    if source.startswith(('http://', 'https://')):
+        return fetch(source)
+    return read_file(source)
+
+
+def read_file(path):
+    '''
+    Returns the contents of a local file, memory-mapped where possible so the decoder reads it
+    straight from the page cache instead of from a copy of the whole file
+    '''
+    with open(path, 'rb') as fs:
+        try:
+            return mmap.mmap(fs.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # Empty files and pipes can not be mapped
+            return fs.read()
+
+
+def process_image():
+    sizes = []
+    for chunk in renderer.iter_output(get_image_data()):
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+        if options.stats and options.format in ('text', 'html'):
+            sizes.extend(len(line) for line in chunk.split('\n')[:-1])
+    if options.stats:
+        sys.stderr.write(encoder.get_stats(sizes) + '\n')
 
 
 def google():
     '''
     Returns the first result from Google Images when searching for the user provided query string
     '''
+    import urllib
+    import json
+    import downloads
     uri = 'http://ajax.googleapis.com/ajax/services/search/images'
     query = options.google.decode('utf8')
-    args = '?v=1.0&safe=off&q=' + urllib2.quote(query.encode('utf-8'))
-    raw = urllib2.urlopen(uri + args)
-    json_object = json.load(raw)
+    args = '?v=1.0&safe=off&q=' + urllib.quote(query.encode('utf-8'))
+    raw = downloads.fetch(uri + args, timeout=options.timeout, cache_size=0)
+    json_object = json.loads(raw)
     try:
         url = json_object['responseData']['results'][0]['unescapedUrl']
         return url
     except IndexError:
         sys.exit('Something went wrong with the google search!')
 
+
+def animate():
+    '''
+    Plays the frames of the image on the terminal, preparing them on a background thread
+    '''
+    import animation
+    im = Image.open(StringIO(get_image_data()))
+    size = renderer.get_output_size(im.size)
+    frames = ((list(renderer.iter_index_rows(renderer.resize_image(frame, size))), duration)
+              for (frame, duration) in animation.iter_frames(im))
+    animation.play(animation.prefetch(frames, FRAMES_AHEAD), renderer.get_encoder(), sys.stdout, options.loop)
+
+
+def tune():
+    '''
+    Shows the image and redraws it with every contrast and threshold typed in. The image is
+    decoded and resized once; each redraw only adjusts the resized pixels and matches and encodes
+    them again.
+    '''
+    import interactive
+    im = Image.open(StringIO(get_image_data()))
+    size = renderer.get_output_size(im.size)
+    resized = renderer.decode_image(im, size).resize(size, renderer.get_mode())
+
+    def render(settings):
+        tuned = Renderer(options, renderer.on_render, **settings)
+        return ''.join(tuned.iter_lines(tuned.adjust_image(resized), metrics.Recorder()))
+    settings = {'contrast': options.contrast or 1.0, 'black_threshold': options.black_threshold,
+                'white_threshold': options.white_threshold}
+    interactive.run(render, settings, sys.stdin, sys.stdout)
+
+
+def render_source(task):
+    '''
+    Renders one batch source, given as (source, data, error): data holds the bytes of a source
+    that was downloaded already, or is None for a local path, which is read here. Runs in a
+    worker process and returns (source, output, error).
+    '''
+    source, data, error = task
+    if error is not None:
+        return source, None, error
+    try:
+        if data is None:
+            data = load_image_data(source)
+        return source, renderer.render(data), None
+    except (IOError, OSError, ValueError) as e:
+        return source, None, str(e)
+
+
+def iter_batch_tasks(sources):
+    '''
+    Yields a render_source task for every source in order. URLs are downloaded concurrently,
+    ahead of the renders, over connections shared by all of them; fetch_all bounds how far.
+    '''
+    import downloads
+    urls = [source for source in sources if source.startswith(('http://', 'https://'))]
+    fetched = downloads.fetch_all(urls, timeout=options.timeout, max_size=int(options.max_size * 1024 * 1024),
+                                  cache_size=int(options.cache_size * 1024 * 1024))
+    for source in sources:
+        if source.startswith(('http://', 'https://')):
+            yield next(fetched)
+        else:
+            yield source, None, None
+
+
+def render_band(band):
+    '''
+    Matches the output lines start to end of the image being rendered across --workers, and
+    encodes them if encode is set; band is (start, end, encode). Runs in a worker process and
+    returns (lines or index row pairs, metrics of the band).
+    '''
+    renderer, pixels = _band_source
+    start, end, encode = band
+    recorder = metrics.Recorder()
+    line_encoder = renderer.get_encoder()
+    if renderer.match_cache is not None:
+        hits, misses = renderer.match_cache.hits, renderer.match_cache.misses
+    results = []
+    for band_start in range(start, end, BAND_ROWS):
+        with recorder.stage('match'):
+            rows = renderer.get_band(pixels, band_start, min(band_start + BAND_ROWS, end))
+        if not encode:
+            results.extend(rows)
+            continue
+        with recorder.stage('emit'):
+            results.extend(line_encoder.encode_line(top_row, bottom_row).encode('utf8') + '\n'
+                           for (top_row, bottom_row) in rows)
+    if renderer.match_cache is not None:
+        recorder.record['match_cache_hits'] = renderer.match_cache.hits - hits
+        recorder.record['match_cache_misses'] = renderer.match_cache.misses - misses
+    return results, recorder.record
+
+
+def process_batch(sources):
+    '''
+    Renders many sources across a pool of worker processes. The workers are forked after the
+    palette and lookup table are built, so they all share them. URLs are downloaded by threads
+    in this process while the workers render. No more than twice as many sources as there are
+    workers are handed to them ahead of the result being written, and fetch_all bounds the
+    downloads, so the images held in memory stay bounded. Each result is written to its own file
+    in --output-dir, or to stdout as a frame: a '<length> <source>' header line followed by
+    exactly length bytes of output. Returns 1 if any source failed, otherwise 0.
+    '''
+    if not sources or sources == ['-']:
+        sources = [line.strip() for line in sys.stdin if line.strip()]
+    status = 0
+    import multiprocessing
+    ahead = 2 * (options.jobs or multiprocessing.cpu_count())
+    tasks = iter_batch_tasks(sources)
+    pending = collections.deque()
+    pool = multiprocessing.Pool(options.jobs)
+    try:
+        for task in itertools.islice(tasks, ahead):
+            pending.append(pool.apply_async(render_source, (task,)))
+        index = 0
+        while pending:
+            source, output, error = pending.popleft().get()
+            for task in itertools.islice(tasks, 1):
+                pending.append(pool.apply_async(render_source, (task,)))
+            if error is not None:
+                sys.stderr.write('%s: %s\n' % (source, error))
+                status = 1
+            elif options.output_dir:
+                name = os.path.basename(source.rstrip('/')) or 'image'
+                extension = 'txt' if options.format == 'text' else options.format
+                path = os.path.join(options.output_dir, '%d-%s.%s' % (index, name, extension))
+                with open(path, 'wb') as fs:
+                    fs.write(output)
+            else:
+                sys.stdout.write('%d %s\n' % (len(output), source))
+                sys.stdout.write(output)
+                sys.stdout.flush()
+            index += 1
+    finally:
+        pool.close()
+        pool.join()
+    return status
+
+
+def check_request(new_options, new_args):
+    '''
+    Returns why the parsed arguments of a server request can not be served, or None. Requests
+    may only set REQUEST_OPTIONS, and their source must be an http(s) URL or a Google query, so
+    clients can not make the server read its own files.
+    '''
+    defaults = parser.get_default_values()
+    for option in parser.option_list:
+        if option.dest and option.dest not in REQUEST_OPTIONS and \
+                getattr(new_options, option.dest) != getattr(defaults, option.dest):
+            return 'Option not allowed in requests: %s' % option.get_opt_string()
+    if new_options.google:
+        if new_args:
+            return 'Give either a URL or --google, not both'
+    elif len(new_args) != 1 or not new_args[0].startswith(('http://', 'https://')):
+        return 'Requests need one http(s) URL or a --google query'
+    return None
+
+
+def render_request(argv):
+    '''
+    Handles one server request in the child process serving it. argv holds the command-line
+    arguments of the request; returns (HTTP status, output). The SERVER_OPTIONS of the server
+    apply to the request.
+    '''
+    try:
+        new_options, new_args = parser.parse_args(argv)
+        error = check_request(new_options, new_args)
+        if error is not None:
+            return 400, error + '\n'
+        for name in SERVER_OPTIONS:
+            setattr(new_options, name, getattr(options, name))
+        configure(new_options, new_args)
+        return 200, renderer.render(get_image_data())
+    except SystemExit as e:
+        return 400, '%s\n' % (e.code if not isinstance(e.code, int) else 'Invalid arguments')
+    except (IOError, ValueError) as e:
+        return 400, '%s\n' % e
+
+
+def start_server():
+    '''
+    Builds the lookup tables of every palette before serving, so request handlers forked from
+    this process find them in memory
+    '''
+    import server
+    if options.matcher == 'lut':
+        for palette in (palettes.irc_rgb_values, palettes.default_rgb_values, palettes.default_rgb_values[:8],
+                        palettes.default_rgb_values + palettes.xterm_rgb_values, palettes.bw_xterm_rgb_values):
+            lookup_table.get_table(palette, options.lut_bits, options.distance)
+    server.serve(options.serve, render_request)
+
 if __name__ == '__main__':
+    new_options, new_args = parser.parse_args()
+    if new_options.auto:
+        fit_terminal(new_options)
+    configure(new_options, new_args)
+    if options.serve:
+        start_server()
+    elif options.animate:
+        if options.irc or options.format != 'text':
+            parser.error('--animate needs a terminal and can not be combined with --irc or --format')
+        animate()
+    elif options.interactive:
+        if options.format != 'text':
+            parser.error('--interactive draws on the terminal and can not be combined with --format')
+        tune()
+        sys.exit()
+    elif options.batch:
+        sys.exit(process_batch(args))
     process_image()
@@ -0,0 +1,157 @@
+'''
+Probing of the terminal an image is shown on: its size in cells, the number of colors it can
+show and the shape of its cells.
+
+The size is read on every run, since windows are resized. Colors and cell shape take a terminfo
+lookup or a query sent to the terminal, so they are cached in the cache directory per TERM (and
+COLORTERM, which is how terminals announce 24-bit color).
+'''
+import os
+import sys
+import json
+import struct
+import select
+import cache
+
+DEFAULT_SIZE = (80, 24)
+DEFAULT_COLORS = 8
+# Height of a cell divided by its width; about 2 for most fonts
+DEFAULT_CELL_ASPECT = 2.0
+# Seconds to wait for the terminal to answer a query
+QUERY_TIMEOUT = 0.1
+# Asks for the size of a cell in pixels; the answer is ESC [ 6 ; height ; width t
+CELL_SIZE_QUERY = '\033[16t'
+
+
+def get_size(fs=sys.stdout):
+    '''
+    Returns (columns, lines) of the terminal fs is connected to, falling back to the COLUMNS and
+    LINES environment variables and then to DEFAULT_SIZE
+    '''
+    lines, columns, x_pixels, y_pixels = get_window_size(fs)
+    if not columns or not lines:
+        try:
+            columns, lines = int(os.environ['COLUMNS']), int(os.environ['LINES'])
+        except (KeyError, ValueError):
+            columns, lines = DEFAULT_SIZE
+    return columns, lines
+
+
+def get_window_size(fs):
+    '''
+    Returns (lines, columns, width in pixels, height in pixels) as reported by the kernel, with
+    zeros for whatever is unknown
+    '''
+    try:
+        import fcntl
+        import termios
+        return struct.unpack('HHHH', fcntl.ioctl(fs.fileno(), termios.TIOCGWINSZ, '\0' * 8))
+    except (ImportError, AttributeError, IOError, ValueError):
+        return 0, 0, 0, 0
+
+
+def get_colors():
+    '''
+    Returns the number of colors the terminal named by TERM can show, or None if terminfo does
+    not know
+    '''
+    if os.environ.get('COLORTERM') in ('truecolor', '24bit'):
+        return 1 << 24
+    try:
+        import curses
+        curses.setupterm()
+        colors = curses.tigetnum('colors')
+    except Exception:
+        return None
+    return colors if colors > 0 else None
+
+
+def get_cell_aspect(fs=sys.stdout):
+    '''
+    Returns the height of a terminal cell divided by its width, from the window size in pixels
+    if the kernel knows it, otherwise by asking the terminal. Returns None if there is no
+    terminal to ask, and 0 if the terminal does not tell.
+    '''
+    lines, columns, x_pixels, y_pixels = get_window_size(fs)
+    if lines and columns and x_pixels and y_pixels:
+        return (float(y_pixels) / lines) / (float(x_pixels) / columns)
+    answer = query(CELL_SIZE_QUERY, 't')
+    if answer is None:
+        return None
+    try:
+        kind, height, width = answer.lstrip('\033[').rstrip('t').split(';')
+        if kind == '6' and int(height) and int(width):
+            return float(height) / int(width)
+    except ValueError:
+        pass
+    return 0
+
+
+def query(sequence, end):
+    '''
+    Writes sequence to the controlling terminal and returns its answer up to and including the
+    character end, '' if it does not answer in QUERY_TIMEOUT, or None if there is no terminal
+    '''
+    try:
+        import termios
+        import tty
+        fd = os.open('/dev/tty', os.O_RDWR | os.O_NOCTTY)
+    except (ImportError, OSError):
+        return None
+    answer = ''
+    try:
+        saved = termios.tcgetattr(fd)
+        tty.setraw(fd)
+        try:
+            os.write(fd, sequence)
+            while not answer.endswith(end) and select.select([fd], [], [], QUERY_TIMEOUT)[0]:
+                answer += os.read(fd, 64)
+        finally:
+            termios.tcsetattr(fd, termios.TCSAFLUSH, saved)
+    except (termios.error, OSError, select.error):
+        return None
+    finally:
+        os.close(fd)
+    return answer if answer.endswith(end) else ''
+
+
+def get_capabilities(fs=sys.stdout):
+    '''
+    Returns {'colors': number of colors, 'cell_aspect': cell height / width} for the terminal.
+    What the probes found out is cached per TERM and COLORTERM, including a terminal not
+    answering the cell size query, which is then not asked again. Whatever they could not tell,
+    say because there was no terminal to ask, is probed again next time and meanwhile taken from
+    DEFAULT_COLORS and DEFAULT_CELL_ASPECT.
+    '''
+    name = '%s-%s' % (os.environ.get('TERM', 'unknown'), os.environ.get('COLORTERM', ''))
+    path = None
+    try:
+        # Files of older versions could hold defaults taken for probed values, so they are not read
+        path = os.path.join(cache.get_cache_dir('terminals'), name.replace(os.sep, '_') + '.v2.json')
+        with open(path) as cached_file:
+            cached = json.load(cached_file)
+    except (IOError, OSError, ValueError):
+        cached = {}
+    if not isinstance(cached, dict):
+        cached = {}
+    capabilities = dict(cached)
+    if capabilities.get('colors') is None:
+        capabilities['colors'] = get_colors()
+    if capabilities.get('cell_aspect') is None:
+        capabilities['cell_aspect'] = get_cell_aspect(fs)
+    found = dict((key, value) for (key, value) in capabilities.items() if value is not None)
+    if found != cached and path is not None:
+        try:
+            cache.write_atomic(path, json.dumps(found))
+        except (IOError, OSError):
+            pass
+    return {'colors': found.get('colors', DEFAULT_COLORS), 'cell_aspect': found.get('cell_aspect') or DEFAULT_CELL_ASPECT}
+
+
+def is_unicode(fs=sys.stdout):
+    '''
+    Returns whether text written to fs is shown as UTF-8, so block characters can be used
+    '''
+    import locale
+    encoding = getattr(fs, 'encoding', None) or locale.getpreferredencoding() or ''
+    return encoding.replace('-', '').lower() == 'utf8'